@@ -1,11 +1,16 @@
-from asyncio import run
+from hashlib import sha256
+import json
 from os import listdir
+import signal
 from sys import argv
+from time import perf_counter
+from typing import Optional
 
-from discord import Intents
+from discord import Intents, Guild
 from discord.ext.commands import Bot, when_mentioned
 
-from util import get_secret
+from util import get_secret, get_const, reload_json
+from util.db import get_value, set_value, migrate
 
 intents = Intents.default()
 intents.members = True
@@ -14,20 +19,106 @@ intents.message_content = True
 # noinspection PyTypeChecker
 bot = Bot(when_mentioned, intents=intents)
 
+started_at = perf_counter()
+# cog name or startup step -> seconds it took
+startup_profile: dict[str, float] = dict()
+
 
 @bot.event
 async def on_ready():
-    await bot.tree.sync()
+    first_ready = 'on_ready' not in startup_profile
+    if first_ready:
+        startup_profile['on_ready'] = perf_counter() - started_at
+
+    start = perf_counter()
+    if await sync_tree() and first_ready:
+        startup_profile['tree.sync'] = perf_counter() - start
+
+    if first_ready:
+        print_startup_profile()
+
+
+def get_tree_hash(guild: Optional[Guild] = None) -> str:
+    commands = sorted((command.to_dict() for command in bot.tree.get_commands(guild=guild)),
+                      key=lambda command: command['name'])
+    return sha256(json.dumps(commands, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+async def sync_tree() -> bool:
+    """
+    syncs the command tree only if it changed since the last sync.
+    with `-t`, syncs to the test guild instead, which applies immediately.
+
+    :return: whether the tree was synced
+    """
+
+    guild = None
+    if '-t' in argv and (channel := bot.get_channel(get_const('channel.test_general'))) is not None:
+        guild = channel.guild
+        bot.tree.copy_global_to(guild=guild)
+
+    # test runs use another application, so they never touch the hash of the production tree
+    if '-t' not in argv:
+        key = 'tree.hash'
+    elif guild is None:
+        key = 'tree.hash.test'
+    else:
+        key = f'tree.hash.test.{guild.id}'
+    tree_hash = get_tree_hash(guild)
+    if await get_value(key) == tree_hash:
+        return False
+
+    await bot.tree.sync(guild=guild)
+    await set_value(key, tree_hash)
+    print(f'Synced command tree: {tree_hash[:12]}')
+    return True
+
+
+@bot.event
+async def setup_hook():
+    start = perf_counter()
+    await migrate()
+    startup_profile['db.migrate'] = perf_counter() - start
+
+    start = perf_counter()
+    await load_extensions()
+    startup_profile['load_extensions'] = perf_counter() - start
+
+
+async def load_extension(name: str):
+    start = perf_counter()
+    await bot.load_extension(f'cogs.{name}')
+    startup_profile[f'cogs.{name}'] = perf_counter() - start
+    print(f'Loaded cog: `{name}`')
 
 
 async def load_extensions():
-    for filename in listdir('cogs'):
+    disabled = get_const('cogs.disabled')
+
+    names = list()
+    for filename in sorted(listdir('cogs')):
         if not filename.endswith('.py'):
             continue
-        await bot.load_extension(f'cogs.{filename[:-3]}')
-        print(f'Loaded cog: `{filename[:-3]}`')
+        if filename[:-3] in disabled:
+            print(f'Skipped disabled cog: `{filename[:-3]}`')
+            continue
+        names.append(filename[:-3])
+
+    # loaded one by one, so that the time of each cog covers only its own import and `cog_load`
+    for name in names:
+        await load_extension(name)
+
+
+def print_startup_profile():
+    width = max(map(len, startup_profile))
+    print('Startup profile')
+    for step, seconds in startup_profile.items():
+        print(f'  {step:<{width}}  {seconds * 1000:>9,.1f} ms')
 
 
 if __name__ == '__main__':
-    run(load_extensions())
+    # `kill -HUP` reloads modified constants without restarting
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: print(f'Reloaded: {reload_json()}'))
+
     bot.run(get_secret('test_bot_token' if '-t' in argv else 'bot_token'))
@@ -1,64 +1,151 @@
 import re
-from asyncio import sleep, wait, TimeoutError as AsyncioTimeoutError
+from asyncio import sleep, Lock
+from bisect import bisect_left, insort
 from math import inf
+from typing import Iterable, Optional
 
-from discord import Member, Guild, Interaction, Reaction, InteractionMessage, Role
-from discord.app_commands import command, MissingRole
-from discord.app_commands.checks import has_role
+from discord import Member, Guild, Interaction, Role, HTTPException
+from discord.app_commands import command, MissingRole, Choice
 from discord.ext.commands import Cog, Bot
 from sat_datetime import SatDatetime
 
-from util import get_const, eul_reul, check_reaction
+from util import get_const, eul_reul, reload_json, confirm, has_const_role
 
 DECORATED_NICK_RE = re.compile(r'^\d{7} .+$')
-ROLE_ID_TABLE = (
-    get_const('role.harnavin'), get_const('role.erasheniluin'), get_const('role.quocerin'), get_const('role.lofanin'),
-    get_const('role.hjulienin'))
-OX_EMOJIS = [get_const('emoji.x'), get_const('emoji.o')]
+ROLE_KEYS = ('role.harnavin', 'role.erasheniluin', 'role.quocerin', 'role.lofanin', 'role.hjulienin')
+ROLE_EDIT_RETRIES = 3  # retries of a rate limited member edit
+ROLE_PROGRESS_INTERVAL = 10  # members
+
+
+ID_PREFIX_RE = re.compile(r'^([0-9])([0-9]{6})')
+
+
+class IdIndex:
+    """
+    7-digit id prefixes used by members of a guild, kept as a sorted list of numbers per role digit
+    so that the next free id is found by binary search.
+    """
+
+    def __init__(self, members: Iterable[Member]):
+        # prefix -> count of members and reservations using it
+        self.counts: dict[str, int] = dict()
+        # role digit -> sorted numbers in use
+        self.numbers: dict[str, list[int]] = dict()
+        # member id -> reserved prefix
+        self.reservations: dict[int, str] = dict()
+
+        for member in members:
+            self.add(member.display_name)
+
+    def add(self, name: str):
+        if (match := ID_PREFIX_RE.match(name)) is None:
+            return
+        if (prefix := match.group(0)) not in self.counts:
+            self.counts[prefix] = 0
+            insort(self.numbers.setdefault(match.group(1), list()), int(match.group(2)))
+        self.counts[prefix] += 1
+
+    def remove(self, name: str):
+        if (match := ID_PREFIX_RE.match(name)) is None or (prefix := match.group(0)) not in self.counts:
+            return
+        self.counts[prefix] -= 1
+        if not self.counts[prefix]:
+            self.counts.pop(prefix)
+            numbers = self.numbers[match.group(1)]
+            numbers.pop(bisect_left(numbers, int(match.group(2))))
+
+    def find(self, role: int, year: int) -> str:
+        numbers = self.numbers.get(str(role), list())
+        start = year * 10 + 1
+
+        # numbers are distinct, so `numbers[i] - i` never decreases,
+        # and it stays `start - first` exactly while the numbers from `start` are consecutive
+        first = lo = bisect_left(numbers, start)
+        hi = len(numbers)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if numbers[mid] - mid == start - first:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return f'{role}{start + lo - first:06d}'
+
+    def reserve(self, member_id: int, role: int, year: int) -> str:
+        """
+        finds the next free id and holds it for the member until `release`.
+        a successful rename is released once the new nick is added by `on_member_update`.
+        """
+
+        self.release(member_id)
+        candidate = self.find(role, year)
+        self.add(candidate)
+        self.reservations[member_id] = candidate
+        return candidate
+
+    def release(self, member_id: int):
+        if (candidate := self.reservations.pop(member_id, None)) is not None:
+            self.remove(candidate)
+
+
+_id_indexes: dict[int, IdIndex] = dict()
+
+
+def get_id_index(guild: Guild) -> IdIndex:
+    if guild.id not in _id_indexes:
+        _id_indexes[guild.id] = IdIndex(guild.members)
+    return _id_indexes[guild.id]
 
 
 def get_proper_id(member: Member, role: int, guild: Guild) -> str:
-    year = SatDatetime.get_from_datetime(member.joined_at.replace(tzinfo=None)).year
-    index = 1
-    names = tuple(map(lambda x: x.display_name[:7], guild.members))
+    """reserves the next free id for the member. release it with `get_id_index(guild).release` once used."""
 
-    while (candidate := f'{role}{year * 10 + index:06d}') in names:
-        index += 1
+    year = SatDatetime.get_from_datetime(member.joined_at.replace(tzinfo=None)).year
+    return get_id_index(guild).reserve(member.id, role, year)
 
-    return candidate
 
+def get_target_roles(member: Member, role_number: str, guild: Guild) -> list[Role]:
+    """roles of the member after assigning roles by the role number, without the default role."""
 
-async def assign_role(member: Member, role_number: str, guild: Guild):
     role_index = int(role_number) - 1
-    for i in range(role_index):
-        await sleep(0)
-        role = guild.get_role(ROLE_ID_TABLE[i])
-        if role in member.roles:
-            await member.remove_roles(role)
-    for i in range(role_index, 5):
-        await sleep(0)
-        role = guild.get_role(ROLE_ID_TABLE[i])
-        if role not in member.roles:
-            await member.add_roles(role)
-
-
-async def get_position(ctx: Interaction, term: int, is_lecture: bool = True):
-    prefix = '강의' if is_lecture else '스터디'
-    position = inf
-    index = 0
-    for guild_role in sorted(ctx.guild.roles, key=lambda x: x.name):
-        await sleep(0)
-        if not guild_role.name.startswith(f'{prefix}:'):
-            continue
-        position = min(guild_role.position, position)
-
-        guild_name = guild_role.name[len(prefix):]
-        role_term = int(guild_name[2:4])
-        role_index = int(guild_name[4:5])
-        if role_term != term:
-            continue
-        index = max(index, role_index)
-    return index, position
+    role_ids = tuple(map(get_const, ROLE_KEYS))
+    removing = set(role_ids[:role_index])
+    roles = [role for role in member.roles if not role.is_default() and role.id not in removing]
+    for role_id in role_ids[role_index:]:
+        if (role := guild.get_role(role_id)) is not None and role not in roles:
+            roles.append(role)
+    return roles
+
+
+async def assign_role(member: Member, role_number: str, guild: Guild) -> bool:
+    """
+    assigns roles by the role number with a single request.
+    :return: whether the roles were changed
+    """
+
+    roles = get_target_roles(member, role_number, guild)
+    if set(roles) == set(member.roles[1:]):
+        return False
+
+    await member.edit(roles=roles)
+    return True
+
+
+async def edit_roles(member: Member, roles: list[Role]) -> bool:
+    """
+    edits roles of the member, waiting as long as discord asks when rate limited.
+    :return: whether the roles were changed
+    """
+
+    for _ in range(ROLE_EDIT_RETRIES + 1):
+        try:
+            await member.edit(roles=roles)
+            return True
+        except HTTPException as e:
+            if e.status != 429:
+                return False
+            await sleep(float(e.response.headers.get('Retry-After', 1)))
+    return False
 
 
 def parse_role_name(name: str) -> tuple[bool, int, int, str]:
@@ -85,9 +172,71 @@ def parse_role_name(name: str) -> tuple[bool, int, int, str]:
     return is_lecture, term, index, title
 
 
+class RoleCatalogue:
+    """lecture and study roles of a guild, indexed by (is_lecture, term, index)."""
+
+    def __init__(self, roles: Iterable[Role]):
+        # (is_lecture, term) -> index -> role
+        self.terms: dict[tuple[bool, int], dict[int, Role]] = dict()
+        # role id -> (is_lecture, term, index)
+        self.keys: dict[int, tuple[bool, int, int]] = dict()
+
+        for role in roles:
+            self.add(role)
+
+    def add(self, role: Role):
+        try:
+            is_lecture, term, index, _ = parse_role_name(role.name)
+        except ValueError:
+            return
+        self.terms.setdefault((is_lecture, term), dict())[index] = role
+        self.keys[role.id] = (is_lecture, term, index)
+
+    def remove(self, role: Role):
+        if (key := self.keys.pop(role.id, None)) is None:
+            return
+        is_lecture, term, index = key
+        roles = self.terms[(is_lecture, term)]
+        if roles.get(index) == role:
+            roles.pop(index)
+        if not roles:
+            self.terms.pop((is_lecture, term))
+
+    def get_roles(self, is_lecture: bool, term: int) -> list[Role]:
+        return sorted(self.terms.get((is_lecture, term), dict()).values(), key=lambda x: x.position, reverse=True)
+
+    def get_terms(self, is_lecture: bool) -> list[int]:
+        return sorted(term for role_is_lecture, term in self.terms if role_is_lecture == is_lecture)
+
+    def get_position(self, term: int, is_lecture: bool = True) -> tuple[int, int]:
+        """
+        :return: largest index used in the term, and the lowest position of the kind of roles to put a new role at
+        """
+
+        index = max(self.terms.get((is_lecture, term), {0: None}))
+        position = min((role.position for (role_is_lecture, _), roles in self.terms.items()
+                        if role_is_lecture == is_lecture for role in roles.values()), default=inf)
+        return index, position
+
+
+_role_catalogues: dict[int, RoleCatalogue] = dict()
+
+
+def get_role_catalogue(guild: Guild) -> RoleCatalogue:
+    if guild.id not in _role_catalogues:
+        _role_catalogues[guild.id] = RoleCatalogue(guild.roles)
+    return _role_catalogues[guild.id]
+
+
+async def term_autocomplete(ctx: Interaction, current: str, is_lecture: bool) -> list[Choice[int]]:
+    return [Choice(name=f'{term}기', value=term) for term in get_role_catalogue(ctx.guild).get_terms(is_lecture)
+            if str(term).startswith(current)][:25]
+
+
 class AdminCog(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.role_lock = Lock()
 
     @Cog.listener()
     async def on_ready(self):
@@ -98,12 +247,49 @@ class AdminCog(Cog):
         if member.guild.id != get_const('guild.lofanfashasch'):
             return
 
+        if member.guild.id in _id_indexes:
+            _id_indexes[member.guild.id].add(member.display_name)
+
         candidate = get_proper_id(member, 5, member.guild)
         name = member.display_name if DECORATED_NICK_RE.match(member.display_name) is None else member.display_name[8:]
         nick = f'{candidate} {name}'
-        await member.edit(nick=nick)
+        try:
+            await member.edit(nick=nick)
+        except Exception:
+            get_id_index(member.guild).release(member.id)
+            raise
         await assign_role(member, nick[0], member.guild)
 
+    @Cog.listener()
+    async def on_member_update(self, before: Member, after: Member):
+        if before.display_name != after.display_name and (index := _id_indexes.get(after.guild.id)) is not None:
+            index.remove(before.display_name)
+            index.add(after.display_name)
+            # the new nick now holds the id, so a reservation for it is no longer needed
+            index.release(after.id)
+
+    @Cog.listener()
+    async def on_guild_role_create(self, role: Role):
+        if (catalogue := _role_catalogues.get(role.guild.id)) is not None:
+            catalogue.add(role)
+
+    @Cog.listener()
+    async def on_guild_role_update(self, before: Role, after: Role):
+        if before.name != after.name and (catalogue := _role_catalogues.get(after.guild.id)) is not None:
+            catalogue.remove(before)
+            catalogue.add(after)
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role: Role):
+        if (catalogue := _role_catalogues.get(role.guild.id)) is not None:
+            catalogue.remove(role)
+
+    @Cog.listener()
+    async def on_member_remove(self, member: Member):
+        if (index := _id_indexes.get(member.guild.id)) is not None:
+            index.remove(member.display_name)
+            index.release(member.id)
+
     @command(name='id', description='규칙에 따라 로판파샤스 아이디를 부여합니다.')
     async def id_(self, ctx: Interaction, member: Member, role: int = 5):
         if not (1 <= role <= 6):
@@ -115,27 +301,19 @@ class AdminCog(Cog):
         name = member.display_name if DECORATED_NICK_RE.match(member.display_name) is None else member.display_name[8:]
         post_name = f'{candidate} {name}'
 
-        await ctx.response.send_message(
-            f'현재 이름은 `{member.display_name}`이고, 이름을 변경하면 `{post_name}`으로 변경됩니다.\n이름을 변경하시겠습니까?')
-        message: InteractionMessage = await ctx.original_response()
-        await wait((message.add_reaction(get_const('emoji.x')), message.add_reaction(get_const('emoji.o'))))
-
+        renamed = False
         try:
-            res: tuple[Reaction, Member] = await self.bot.wait_for(
-                'reaction_add',
-                timeout=60.0,
-                check=check_reaction(OX_EMOJIS, ctx, message.id))
-            await message.clear_reactions()
-        except AsyncioTimeoutError:
-            await message.edit(content=f':x: 시간이 초과되어 작업이 취소되었습니다.')
-            return
-
-        if res[0].emoji == get_const('emoji.x'):
-            await message.edit(content=f':x: 사용자가 작업을 취소하였습니다.')
-            return
-
-        await member.edit(nick=post_name)
-        await message.edit(content=f'이름을 변경했습니다.\n> `{member.display_name}` > `{post_name}`')
+            if not await confirm(
+                    ctx, f'현재 이름은 `{member.display_name}`이고, 이름을 변경하면 `{post_name}`으로 변경됩니다.\n'
+                         f'이름을 변경하시겠습니까?'):
+                return
+            await member.edit(nick=post_name)
+            renamed = True
+        finally:
+            # after a rename the id stays reserved until `on_member_update` adds the new nick
+            if not renamed:
+                get_id_index(ctx.guild).release(member.id)
+        await ctx.edit_original_response(content=f'이름을 변경했습니다.\n> `{member.display_name}` > `{post_name}`')
 
     @command(name='role', description='닉네임에 따라 로판파샤스 역할을 부여합니다.')
     async def role_(self, ctx: Interaction, member: Member):
@@ -146,6 +324,48 @@ class AdminCog(Cog):
         await assign_role(member, role_number, ctx.guild)
         await ctx.response.send_message(f'역할을 부여했습니다.')
 
+    @command(name='role_all', description='닉네임에 따라 여러 멤버의 로판파샤스 역할을 한 번에 정리합니다.')
+    @has_const_role('role.harnavin')
+    async def role_all(self, ctx: Interaction, role: Optional[Role] = None):
+        if self.role_lock.locked():
+            await ctx.response.send_message(':x: 이미 역할을 정리하고 있습니다. 끝난 뒤에 다시 시도해주세요.', ephemeral=True)
+            return
+
+        async with self.role_lock:
+            # only members whose roles actually change cost a request
+            queue = list()
+            for member in role.members if role is not None else ctx.guild.members:
+                if (role_number := member.display_name[:1]) not in tuple('12345'):
+                    continue
+                if set(roles := get_target_roles(member, role_number, ctx.guild)) != set(member.roles[1:]):
+                    queue.append((member, roles))
+
+            if not queue:
+                await ctx.response.send_message('역할을 바꿔야 하는 멤버가 없습니다.')
+                return
+
+            await ctx.response.send_message(f'멤버 __{len(queue)}명__의 역할을 정리합니다.')
+            # the interaction token expires after 15 minutes, so report progress with a plain message
+            progress = await ctx.channel.send(f'멤버 __{len(queue)}명__의 역할을 정리하는 중입니다. (0/{len(queue)})')
+
+            failed = list()
+            for i, (member, roles) in enumerate(queue, 1):
+                if not await edit_roles(member, roles):
+                    failed.append(member)
+
+                if i % ROLE_PROGRESS_INTERVAL == 0 and i < len(queue):
+                    await progress.edit(content=f'멤버 __{len(queue)}명__의 역할을 정리하는 중입니다. '
+                                                f'({i}/{len(queue)})')
+
+        failed_string = '\n실패한 멤버: ' + ', '.join(f'`{member.display_name}`' for member in failed) if failed else ''
+        await progress.edit(content=f'멤버 __{len(queue) - len(failed)}명__의 역할을 정리했습니다.{failed_string}')
+
+    @role_all.error
+    async def role_all_error(self, ctx: Interaction, error: Exception):
+        if isinstance(error, MissingRole):
+            await ctx.response.send_message(':x: 명령어를 사용하기 위한 권한이 부족합니다!')
+            return
+
     @command(description='역할에 어떤 멤버가 있는지 확인합니다.')
     async def check_role(self, ctx: Interaction, role: Role, ephemeral: bool = True):
         members = list()
@@ -163,27 +383,13 @@ class AdminCog(Cog):
             f'\n{list_string}', ephemeral=ephemeral)
 
     @command(description='강의를 개설합니다.')
-    @has_role(get_const('role.harnavin'))
+    @has_const_role('role.harnavin')
     async def new_lecture(self, ctx: Interaction, name: str, term: int, erasheniluin: Member):
-        # noinspection DuplicatedCode
-        await ctx.response.send_message(
-            f'이름이 `{name}`인 {term}기 강의를 개설합니다. 이 작업을 취소하는 기능은 지원되지 않습니다. 동의하십니까?')
-        message = await ctx.original_response()
-        await wait((message.add_reaction(get_const('emoji.x')), message.add_reaction(get_const('emoji.o'))))
-
-        try:
-            res: tuple[Reaction, Member] = await self.bot.wait_for(
-                'reaction_add', check=check_reaction(OX_EMOJIS, ctx, message.id))
-            await message.clear_reactions()
-        except AsyncioTimeoutError:
-            await message.edit(content=':x: 시간이 초과되어 작업이 취소되었습니다.')
-            return
-
-        if res[0].emoji == get_const('emoji.x'):
-            await message.edit(content=':x: 사용자가 작업을 취소하였습니다.')
+        if not await confirm(
+                ctx, f'이름이 `{name}`인 {term}기 강의를 개설합니다. 이 작업을 취소하는 기능은 지원되지 않습니다. 동의하십니까?'):
             return
 
-        index, position = await get_position(ctx, term)
+        index, position = get_role_catalogue(ctx.guild).get_position(term)
 
         role = await ctx.guild.create_role(
             name=f'강의:1{term:02d}{index + 1} ' + name, colour=get_const('color.lecture'),
@@ -191,7 +397,11 @@ class AdminCog(Cog):
         await role.edit(position=position)
         await erasheniluin.add_roles(role)
 
-        await message.edit(content=f'{role.mention} 강의를 개설했습니다.')
+        await ctx.edit_original_response(content=f'{role.mention} 강의를 개설했습니다.')
+
+    @new_lecture.autocomplete('term')
+    async def new_lecture_term_autocomplete(self, ctx: Interaction, current: str) -> list[Choice[int]]:
+        return await term_autocomplete(ctx, current, True)
 
     @new_lecture.error
     async def new_lecture_error(self, ctx: Interaction, error: Exception):
@@ -200,34 +410,24 @@ class AdminCog(Cog):
             return
 
     @command(description='스터디를 개설합니다.')
-    @has_role(get_const('role.harnavin'))
+    @has_const_role('role.harnavin')
     async def new_study(self, ctx: Interaction, name: str, term: int):
-        # noinspection DuplicatedCode
-        await ctx.response.send_message(
-            f'이름이 `{name}`인 {term}기 스터디를 개설합니다. 이 작업을 취소하는 기능은 지원되지 않습니다. 동의하십니까?')
-        message = await ctx.original_response()
-        await wait((message.add_reaction(get_const('emoji.x')), message.add_reaction(get_const('emoji.o'))))
-
-        try:
-            res: tuple[Reaction, Member] = await self.bot.wait_for(
-                'reaction_add', check=check_reaction(OX_EMOJIS, ctx, message.id))
-            await message.clear_reactions()
-        except AsyncioTimeoutError:
-            await message.edit(content=':x: 시간이 초과되어 작업이 취소되었습니다.')
+        if not await confirm(
+                ctx, f'이름이 `{name}`인 {term}기 스터디를 개설합니다. 이 작업을 취소하는 기능은 지원되지 않습니다. 동의하십니까?'):
             return
 
-        if res[0].emoji == get_const('emoji.x'):
-            await message.edit(content=':x: 사용자가 작업을 취소하였습니다.')
-            return
-
-        index, position = await get_position(ctx, term, False)
+        index, position = get_role_catalogue(ctx.guild).get_position(term, False)
 
         role = await ctx.guild.create_role(
             name=f'스터디:2{term:02d}{index + 1} ' + name, colour=get_const('color.study'),
             mentionable=True)
         await role.edit(position=position)
 
-        await message.edit(content=f'{role.mention} 스터디를 개설했습니다.')
+        await ctx.edit_original_response(content=f'{role.mention} 스터디를 개설했습니다.')
+
+    @new_study.autocomplete('term')
+    async def new_study_term_autocomplete(self, ctx: Interaction, current: str) -> list[Choice[int]]:
+        return await term_autocomplete(ctx, current, False)
 
     @new_study.error
     async def new_study_error(self, ctx: Interaction, error: Exception):
@@ -241,56 +441,57 @@ class AdminCog(Cog):
             await ctx.response.send_message(f':x: 기수는 1 이상으로 입력해야 합니다.', ephemeral=True)
             return
 
-        lines = list()
-        for role in ctx.guild.roles:
-            try:
-                is_lecture, role_term, index, title = parse_role_name(role.name)
-            except ValueError:
-                continue
-
-            if not is_lecture:
-                continue
-            if role_term != term:
-                continue
-
-            lines.append(role.name)
-
-        list_string = '> ' + '\n> '.join(lines[::-1])
+        lines = [role.name for role in get_role_catalogue(ctx.guild).get_roles(True, term)]
 
         if not lines:
             await ctx.response.send_message(f'{term}기에는 (아직) 강의가 없습니다!', ephemeral=True)
             return
 
+        list_string = '> ' + '\n> '.join(lines)
         await ctx.response.send_message(f'{term}기의 강의 목록은 다음과 같습니다.\n{list_string}', ephemeral=True)
 
+    @lectures.autocomplete('term')
+    async def lectures_term_autocomplete(self, ctx: Interaction, current: str) -> list[Choice[int]]:
+        return await term_autocomplete(ctx, current, True)
+
     @command(description='스터디 목록을 확인합니다.')
     async def studies(self, ctx: Interaction, term: int):
         if term <= 0:
             await ctx.response.send_message(f':x: 기수는 1 이상으로 입력해야 합니다.', ephemeral=True)
             return
 
-        lines = list()
-        for role in ctx.guild.roles:
-            try:
-                is_lecture, role_term, index, title = parse_role_name(role.name)
-            except ValueError:
-                continue
-
-            if is_lecture:
-                continue
-            if role_term != term:
-                continue
-
-            lines.append(role.name)
-
-        list_string = '> ' + '\n> '.join(lines[::-1])
+        lines = [role.name for role in get_role_catalogue(ctx.guild).get_roles(False, term)]
 
         if not lines:
             await ctx.response.send_message(f'{term}기에는 (아직) 스터디가 없습니다!', ephemeral=True)
             return
 
+        list_string = '> ' + '\n> '.join(lines)
         await ctx.response.send_message(f'{term}기의 스터디 목록은 다음과 같습니다.\n{list_string}', ephemeral=True)
 
+    @studies.autocomplete('term')
+    async def studies_term_autocomplete(self, ctx: Interaction, current: str) -> list[Choice[int]]:
+        return await term_autocomplete(ctx, current, False)
+
+    @command(name='reload', description='변경된 설정 파일을 다시 불러옵니다.')
+    @has_const_role('role.harnavin')
+    async def reload_(self, ctx: Interaction, force: bool = False):
+        reloaded = reload_json(force)
+
+        if not reloaded:
+            await ctx.response.send_message('변경된 설정 파일이 없습니다.', ephemeral=True)
+            return
+
+        await ctx.response.send_message(f'설정 파일을 다시 불러왔습니다. ({", ".join(reloaded)})\n'
+                                        '봇 토큰, 데이터베이스 설정, 비활성화할 코그 목록은 재시작해야 적용됩니다.',
+                                        ephemeral=True)
+
+    @reload_.error
+    async def reload_error(self, ctx: Interaction, error: Exception):
+        if isinstance(error, MissingRole):
+            await ctx.response.send_message(':x: 명령어를 사용하기 위한 권한이 부족합니다!')
+            return
+
     @command(description='역할을 부여합니다.')
     async def give_role(self, ctx: Interaction, role: Role):
         await ctx.user.add_roles(role)
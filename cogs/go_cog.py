@@ -1,30 +1,28 @@
+from asyncio import to_thread, create_task, Task
+from collections import OrderedDict
 from copy import copy
+from io import BytesIO
+from random import Random
+from threading import Lock
+from typing import Optional, Callable
 
 from PIL import Image, ImageDraw, ImageFont
 from discord import app_commands, Interaction, File
 from discord.ext.commands import Cog, Bot
 
-from util import eul_reul
+from util import eul_reul, get_const
 from util.db import get_connection
 
 SIDE = 19
-IMAGE_SIDE = 128
-
-GO_LU = Image.open('res/go/go1.png')
-GO_RU = Image.open('res/go/go2.png')
-GO_LD = Image.open('res/go/go3.png')
-GO_RD = Image.open('res/go/go4.png')
-GO_U = Image.open('res/go/go5.png')
-GO_L = Image.open('res/go/go6.png')
-GO_R = Image.open('res/go/go7.png')
-GO_D = Image.open('res/go/go8.png')
-GO_H = Image.open('res/go/go9.png')
-GO_BLANK = Image.open('res/go/go0.png')
-GO_BLACK = Image.open('res/go/gob.png')
-GO_WHITE = Image.open('res/go/gow.png')
-GO_BLACK_PREVIOUS = Image.open('res/go/gobp.png')
-GO_WHITE_PREVIOUS = Image.open('res/go/gowp.png')
-GO_NONE = Image.open('res/go/gon.png')
+IMAGE_SIDE = 128  # size of the tile files
+IMAGE_SIDES = (32, 64, IMAGE_SIDE)
+
+TILE_FILES = {
+    'lu': 'go1', 'ru': 'go2', 'ld': 'go3', 'rd': 'go4',
+    'u': 'go5', 'l': 'go6', 'r': 'go7', 'd': 'go8',
+    'hwajeom': 'go9', 'blank': 'go0',
+    'black': 'gob', 'white': 'gow', 'black_previous': 'gobp', 'white_previous': 'gowp',
+}
 
 BLACK = 'b'
 WHITE = 'w'
@@ -35,11 +33,14 @@ ALPHABET_ORDER = 'ABCDEFGHJKLMNOPQRST'
 Board = list[list[Image]]
 
 
-def get_blank_board() -> Board:
-    row_1 = [GO_LU] + [GO_U] * 17 + [GO_RU]
-    row_general = [GO_L] + [GO_BLANK] * 17 + [GO_R]
-    row_hwajeom = [GO_L] + [GO_BLANK] * 2 + [GO_H] + ([GO_BLANK] * 5 + [GO_H]) * 2 + [GO_BLANK] * 2 + [GO_R]
-    row_19 = [GO_LD] + [GO_D] * 17 + [GO_RD]
+def get_blank_board(tiles: dict[str, Image]) -> Board:
+    lu, ru, ld, rd, u, l, r, d, h, blank = (tiles[name] for name in (
+        'lu', 'ru', 'ld', 'rd', 'u', 'l', 'r', 'd', 'hwajeom', 'blank'))
+
+    row_1 = [lu] + [u] * 17 + [ru]
+    row_general = [l] + [blank] * 17 + [r]
+    row_hwajeom = [l] + [blank] * 2 + [h] + ([blank] * 5 + [h]) * 2 + [blank] * 2 + [r]
+    row_19 = [ld] + [d] * 17 + [rd]
 
     return [
         row_1,
@@ -64,91 +65,619 @@ def get_blank_board() -> Board:
     ]
 
 
-def draw_board(content: str, last: int = -1) -> Board:
-    board = get_blank_board()
-
-    for i in range(min(len(content), SIDE*SIDE)):
-        if not content[i]:
-            continue
-
-        y = i // SIDE
-        x = i % SIDE
-
-        if content[i] == WHITE:
-            board[y][x] = GO_WHITE_PREVIOUS if last == i else GO_WHITE
-        elif content[i] == BLACK:
-            board[y][x] = GO_BLACK_PREVIOUS if last == i else GO_BLACK
-
-    return board
-
-
 LABEL_COLOR = (44, 44, 44)
-BOARD_IMAGE_WIDTH = (SIDE + 2) * IMAGE_SIDE
-BOARD_IMAGE_HEIGHT = (SIDE + 3) * IMAGE_SIDE
+FONT_PATH = 'res/font/Pretendard-Light_0.otf'
+
+
+class GoAssets:
+    """
+    tiles decoded into memory and label fonts, loaded once on first use.
+    `warm_up` loads them ahead of the first command.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tiles: dict[int, dict[str, Image]] = dict()
+        self.fonts: dict[int, ImageFont.FreeTypeFont] = dict()
+
+    def get_tiles(self, side: int = IMAGE_SIDE) -> dict[str, Image]:
+        with self.lock:
+            if IMAGE_SIDE not in self.tiles:
+                tiles = dict()
+                for name, file in TILE_FILES.items():
+                    with Image.open(f'res/go/{file}.png') as image:
+                        tiles[name] = image.convert('RGB')
+                self.tiles[IMAGE_SIDE] = tiles
+
+            if side not in self.tiles:
+                self.tiles[side] = {name: tile.resize((side, side), Image.LANCZOS)
+                                    for name, tile in self.tiles[IMAGE_SIDE].items()}
+            return self.tiles[side]
+
+    def get_font(self, size: int) -> ImageFont.FreeTypeFont:
+        with self.lock:
+            if size not in self.fonts:
+                self.fonts[size] = ImageFont.truetype(FONT_PATH, size)
+            return self.fonts[size]
+
+    def warm_up(self, sides: tuple[int, ...]):
+        for side in sides:
+            renderer = get_renderer(side)
+            with renderer.lock:
+                renderer.get_blank()
+
+
+assets = GoAssets()
+
+
+class TileSet:
+    """tiles and label font scaled to `side` pixels per intersection."""
+
+    def __init__(self, side: int):
+        self.side = side
+        self.width = (SIDE + 2) * side
+        self.height = (SIDE + 3) * side
+        self.font_size = side // 2
+        self.font = assets.get_font(self.font_size)
+
+        tiles = assets.get_tiles(side)
+        self.blank = [tile for row in get_blank_board(tiles) for tile in row]
+        self.black = tiles['black']
+        self.white = tiles['white']
+        self.black_previous = tiles['black_previous']
+        self.white_previous = tiles['white_previous']
+
+    def get_tile(self, stone: str, index: int, last: int = -1) -> Image:
+        if stone == WHITE:
+            return self.white_previous if last == index else self.white
+        if stone == BLACK:
+            return self.black_previous if last == index else self.black
+        return self.blank[index]
+
+    def get_position(self, index: int) -> tuple[int, int]:
+        return self.side * (index % SIDE + 1), self.side * (index // SIDE + 1)
+
+
+def draw_id(image: Image, tiles: TileSet, id_: int):
+    draw = ImageDraw.Draw(image)
 
+    text = f'바둑판 #{id_}'
+    w = draw.textlength(text, tiles.font)
+    dx = round((tiles.width - w) / 2)
+    dy = round((tiles.side - tiles.font_size) / 2)
+    draw.text((dx, (SIDE + 2) * tiles.side + dy), text, LABEL_COLOR, tiles.font)
 
-def create_image(board: str, last: int = -1, id_: int = -1) -> Image:
-    image = Image.new("RGB", (BOARD_IMAGE_WIDTH, BOARD_IMAGE_HEIGHT), '#eac159')
-    draw = ImageDraw.Draw(image)
-    font = ImageFont.truetype('res/font/Pretendard-Light_0.otf', 64)
 
-    # write id
-    if id_ != -1:
-        text = f'바둑판 #{id_}'
-        w = draw.textlength(text, font)
-        dx = round((BOARD_IMAGE_WIDTH - w) / 2)
-        dy = round((IMAGE_SIDE - 64) / 2)
-        draw.text((dx, (SIDE + 2) * IMAGE_SIDE + dy), text, LABEL_COLOR, font)
+def draw_labels(image: Image, tiles: TileSet):
+    draw = ImageDraw.Draw(image)
+    side, font = tiles.side, tiles.font
 
-    # write label
     for i in range(SIDE):
         text = ALPHABET_ORDER[i]
         w = draw.textlength(text, font)
-        dx = round((IMAGE_SIDE - w) / 2)
-        dy = round((IMAGE_SIDE - 64) / 2)
-        draw.text(((i + 1) * IMAGE_SIDE + dx, 0 + dy), text, LABEL_COLOR, font)
-        draw.text(((i + 1) * IMAGE_SIDE + dx, 20 * IMAGE_SIDE + dy), text, LABEL_COLOR, font)
+        dx = round((side - w) / 2)
+        dy = round((side - tiles.font_size) / 2)
+        draw.text(((i + 1) * side + dx, 0 + dy), text, LABEL_COLOR, font)
+        draw.text(((i + 1) * side + dx, 20 * side + dy), text, LABEL_COLOR, font)
 
         text = str(SIDE - i)
         w = draw.textlength(text, font)
-        dx = round((IMAGE_SIDE - w) / 2)
-        dy = round((IMAGE_SIDE - 64) / 2)
-        draw.text((dx, (i + 1) * IMAGE_SIDE + dy), text, LABEL_COLOR, font)
-        draw.text((dx + 20 * IMAGE_SIDE, (i + 1) * IMAGE_SIDE + dy), text, LABEL_COLOR, font)
+        dx = round((side - w) / 2)
+        dy = round((side - tiles.font_size) / 2)
+        draw.text((dx, (i + 1) * side + dy), text, LABEL_COLOR, font)
+        draw.text((dx + 20 * side, (i + 1) * side + dy), text, LABEL_COLOR, font)
+
+
+def get_image_size(image: Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class BoardRenderer:
+    """
+    renders boards incrementally at one resolution.
+    the labelled empty board is drawn once, and the last image of each board is kept
+    so that only the intersections changed since then are pasted again.
+    kept images are evicted in lru order once they take more than `go.render_cache_bytes`.
+    """
+
+    def __init__(self, side: int):
+        self.side = side
+        # renders run in worker threads and reuse cached images, so render and encode under this lock
+        self.lock = Lock()
+        self.tiles: Optional[TileSet] = None
+        self.blank: Optional[Image] = None
+        # id -> (content, last, image)
+        self.boards: OrderedDict[int, tuple[str, int, Image]] = OrderedDict()
+        self.size = 0
+
+    def get_blank(self) -> Image:
+        if self.blank is None:
+            self.tiles = tiles = TileSet(self.side)
+            blank = Image.new("RGB", (tiles.width, tiles.height), '#eac159')
+            draw_labels(blank, tiles)
+            for i, tile in enumerate(tiles.blank):
+                blank.paste(tile, tiles.get_position(i))
+            self.blank = blank
+        return self.blank
+
+    def render(self, content: str, last: int = -1, id_: int = -1) -> Image:
+        """
+        returns the image of the board. the returned image is reused by the next render of
+        the same board, so it must not be modified.
+        """
+
+        content = content[:SIDE * SIDE].ljust(SIDE * SIDE, NONE)
+
+        if (cached := self.boards.pop(id_, None)) is not None:
+            previous, previous_last, image = cached
+            self.size -= get_image_size(image)
+            dirty = {i for i in range(SIDE * SIDE) if content[i] != previous[i]}
+            dirty.update((previous_last, last))
+        else:
+            image = self.get_blank().copy()
+            if id_ != -1:
+                draw_id(image, self.tiles, id_)
+            dirty = {i for i in range(SIDE * SIDE) if content[i] != NONE}
+            dirty.add(last)
 
-    # draw dots
-    board = draw_board(board, last)
-    for i in range(SIDE):
-        for j in range(SIDE):
-            content = board[i][j]
-            image.paste(content, (IMAGE_SIDE * (j+1), IMAGE_SIDE * (i+1)))
+        for i in dirty:
+            if 0 <= i < SIDE * SIDE:
+                image.paste(self.tiles.get_tile(content[i], i, last), self.tiles.get_position(i))
+
+        self.boards[id_] = (content, last, image)
+        self.size += get_image_size(image)
+        while self.size > get_const('go.render_cache_bytes') and self.boards:
+            self.size -= get_image_size(self.boards.popitem(last=False)[1][2])
+
+        return image
+
+
+renderers = {side: BoardRenderer(side) for side in IMAGE_SIDES}
+
+
+def get_renderer(side: Optional[int] = None) -> BoardRenderer:
+    if side is None:
+        side = get_const('go.size')
+    return renderers[side]
+
+
+IMAGE_EXTENSIONS = {'PNG': 'png', 'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def encode_image(image: Image) -> tuple[BytesIO, str]:
+    """
+    encodes the image by `go.*` constants.
+    :return: buffer and file extension
+    """
+
+    format_ = get_const('go.format').upper()
+    buffer = BytesIO()
+
+    if format_ == 'PNG':
+        if colors := get_const('go.palette_colors'):
+            image = image.quantize(colors)
+        image.save(buffer, format_, compress_level=get_const('go.compress_level'))
+    else:
+        image.save(buffer, format_, quality=get_const('go.quality'))
+
+    buffer.seek(0)
+    return buffer, IMAGE_EXTENSIONS[format_]
+
+
+def render_board(board: str, last: int = -1, id_: int = -1, side: Optional[int] = None) -> tuple[BytesIO, str]:
+    renderer = get_renderer(side)
+    with renderer.lock:
+        return encode_image(renderer.render(board, last, id_))
+
+
+class ImageCache:
+    """lru cache of encoded board images, capped by their total size in bytes."""
+
+    def __init__(self):
+        self.images: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[tuple[bytes, str]]:
+        if (image := self.images.get(key)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.images.move_to_end(key)
+        return image
+
+    def put(self, key: tuple, data: bytes, extension: str):
+        if (previous := self.images.pop(key, None)) is not None:
+            self.size -= len(previous[0])
+        self.images[key] = (data, extension)
+        self.size += len(data)
+
+        while self.size > get_const('go.cache_bytes') and self.images:
+            data, _ = self.images.popitem(last=False)[1]
+            self.size -= len(data)
+
+
+image_cache = ImageCache()
+
+
+def get_cache_key(id_: int, changes: int, side: Optional[int] = None) -> tuple:
+    # `(id, changes)` identifies a version of a board, and the rest are the options changing its image
+    return (id_, changes, side or get_const('go.size'), get_const('go.format').upper(),
+            get_const('go.compress_level'), get_const('go.quality'), get_const('go.palette_colors'))
+
+
+async def get_board_file(id_: int, changes: int, board: str, last: int = -1, side: Optional[int] = None) -> File:
+    key = get_cache_key(id_, changes, side)
+    if (cached := image_cache.get(key)) is None:
+        buffer, extension = await to_thread(render_board, board, last, id_, side)
+        cached = (buffer.getvalue(), extension)
+        image_cache.put(key, *cached)
+
+    data, extension = cached
+    return File(BytesIO(data), f'go_{id_}_{changes}.{extension}')
+
+
+# byte codes of stones in `GoBoard` and their `go_board.content` characters
+STONES = (NONE, BLACK, WHITE)
+ENCODE_STONES = bytes.maketrans(''.join(STONES).encode(), bytes(range(len(STONES))))
+DECODE_STONES = bytes.maketrans(bytes(range(len(STONES))), ''.join(STONES).encode())
+
+MODIFY_RETRIES = 5
+ENGINE_CAPACITY = 8  # boards whose engines are kept in memory
+SNAPSHOT_INTERVAL = 20
+
+# kinds of `go_move` rows
+PUT = 'p'
+CLEAR = 'c'
+UNDO = 'u'
+CONFLICT_MESSAGE = ':x: 다른 사람이 바둑판을 계속 수정하고 있어 작업하지 못했습니다. 잠시 후 다시 시도해주세요.'
+
+
+class GoBoard:
+    """board with one byte per intersection, indexed by `y * SIDE + x`."""
+
+    __slots__ = ('cells',)
+
+    def __init__(self, cells: Optional[bytearray] = None):
+        self.cells = cells if cells is not None else bytearray(SIDE * SIDE)
+
+    @classmethod
+    def from_string(cls, content: str) -> 'GoBoard':
+        cells = bytearray(content[:SIDE * SIDE].ljust(SIDE * SIDE, NONE).encode().translate(ENCODE_STONES))
+        # unknown characters are treated as empty intersections
+        for i in range(len(cells)):
+            if cells[i] >= len(STONES):
+                cells[i] = 0
+        return cls(cells)
+
+    def to_string(self) -> str:
+        return self.cells.translate(DECODE_STONES).decode()
+
+    def __getitem__(self, index: int) -> str:
+        return STONES[self.cells[index]]
+
+    def __setitem__(self, index: int, stone: str):
+        self.cells[index] = STONES.index(stone)
+
+
+NEIGHBORS = [
+    tuple(y * SIDE + x for y, x in ((i // SIDE - 1, i % SIDE), (i // SIDE + 1, i % SIDE),
+                                    (i // SIDE, i % SIDE - 1), (i // SIDE, i % SIDE + 1))
+          if 0 <= y < SIDE and 0 <= x < SIDE)
+    for i in range(SIDE * SIDE)]
 
-    return image
+_zobrist_random = Random(SIDE)
+ZOBRIST_KEYS = [(0, _zobrist_random.getrandbits(64), _zobrist_random.getrandbits(64)) for _ in range(SIDE * SIDE)]
 
 
-def change_single(board: str, y: int, x: int, to: str) -> str:
-    now = list(' ' * SIDE * SIDE)
-    for i in range(len(board)):
-        now[i] = board[i]
-    now[y * SIDE + x] = to
-    return ''.join(now)
+class IllegalMoveError(ValueError):
+    pass
 
 
-def get_board_by_id(id_: int) -> tuple[str, int, int, int]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT content, last, changes, last_putter FROM go_board WHERE id = %s', (id_,))
-        data = cursor.fetchone()
-    return data if data is not None else ('', -1, 0, -1)
+class GoEngine:
+    """
+    applies moves with captures, suicide and positional superko checks.
+    stones are kept in union-find groups with pseudo-liberty counts and a circular list of
+    their stones, so a move costs time proportional to the stones it captures, not the board.
 
+    the superko history only covers positions played through this engine, so a repetition
+    is only rejected until the engine is rebuilt, e.g. after a restart, an undo or an edit.
+    """
 
-def update_board_by_id(id_: int, board: str, last: int, changes: int, last_putter: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO go_board(id, content, last, last_putter) VALUES (%s, %s, %s, %s) '
-                       'ON DUPLICATE KEY UPDATE content = %s, last = %s, changes = %s, last_putter = %s',
-                       (id_, board, last, last_putter, board, last, changes, last_putter))
-        database.commit()
+    def __init__(self, board: GoBoard):
+        self.board = GoBoard(bytearray(board.cells))
+        self.parent = list(range(SIDE * SIDE))
+        self.size = [1] * (SIDE * SIDE)
+        # counts every (stone, empty neighbor) pair, so a group is dead exactly when it reaches 0
+        self.liberties = [0] * (SIDE * SIDE)
+        self.next_stone = list(range(SIDE * SIDE))
+        self.hash = 0
+
+        # start from an empty board, so every stone sees only the stones placed before it
+        stones = bytes(board.cells)
+        self.board.cells[:] = bytes(SIDE * SIDE)
+        for i, code in enumerate(stones):
+            if code:
+                self._place(i, code)
+        self.history = {self.hash}
+
+    def find(self, index: int) -> int:
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def _union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        self.liberties[a] += self.liberties[b]
+        self.next_stone[a], self.next_stone[b] = self.next_stone[b], self.next_stone[a]
+
+    def _place(self, index: int, code: int):
+        cells = self.board.cells
+        cells[index] = code
+        self.hash ^= ZOBRIST_KEYS[index][code]
+        self.parent[index] = index
+        self.size[index] = 1
+        self.next_stone[index] = index
+        self.liberties[index] = 0
+
+        for neighbor in NEIGHBORS[index]:
+            if cells[neighbor]:
+                self.liberties[self.find(neighbor)] -= 1
+            else:
+                self.liberties[index] += 1
+        for neighbor in NEIGHBORS[index]:
+            if cells[neighbor] == code:
+                self._union(index, neighbor)
+
+    def get_group(self, index: int) -> list[int]:
+        stones = [index]
+        stone = self.next_stone[index]
+        while stone != index:
+            stones.append(stone)
+            stone = self.next_stone[stone]
+        return stones
+
+    def _remove_group(self, root: int) -> int:
+        cells = self.board.cells
+        stones = self.get_group(root)
+        for stone in stones:
+            self.hash ^= ZOBRIST_KEYS[stone][cells[stone]]
+            cells[stone] = 0
+        for stone in stones:
+            for neighbor in NEIGHBORS[stone]:
+                if cells[neighbor]:
+                    self.liberties[self.find(neighbor)] += 1
+            self.parent[stone] = stone
+            self.next_stone[stone] = stone
+        return len(stones)
+
+    def play(self, index: int, stone: str, superko: bool = True) -> int:
+        """
+        puts the stone and removes the groups it captures.
+
+        :param superko: reject moves repeating a position. replays of the log skip this check,
+                        since the moves were legal against the history of the engine that played them.
+        :return: count of captured stones
+        """
+
+        cells = self.board.cells
+        if cells[index]:
+            raise IllegalMoveError('이미 돌이 놓인 자리입니다.')
+
+        code = STONES.index(stone)
+        empty = 0
+        adjacent: dict[int, int] = dict()
+        for neighbor in NEIGHBORS[index]:
+            if cells[neighbor]:
+                root = self.find(neighbor)
+                adjacent[root] = adjacent.get(root, 0) + 1
+            else:
+                empty += 1
+
+        # a neighboring group is out of liberties after this move when all of its liberties are this point
+        captured = [root for root, count in adjacent.items() if cells[root] != code and self.liberties[root] == count]
+        if not empty and not captured and all(
+                self.liberties[root] == count for root, count in adjacent.items() if cells[root] == code):
+            raise IllegalMoveError('착수 금지점입니다. (자충수)')
+
+        position = self.hash ^ ZOBRIST_KEYS[index][code]
+        for root in captured:
+            for captured_stone in self.get_group(root):
+                position ^= ZOBRIST_KEYS[captured_stone][cells[captured_stone]]
+        if superko and position in self.history:
+            raise IllegalMoveError('같은 배치가 반복되는 수는 둘 수 없습니다. (패)')
+
+        self._place(index, code)
+        captures = sum(self._remove_group(root) for root in captured)
+        self.history.add(self.hash)
+        return captures
+
+
+async def get_board_by_id(id_: int) -> tuple[GoBoard, int, int, int]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT content, last, changes, last_putter FROM go_board WHERE id = %s', (id_,))
+        data = await cursor.fetchone()
+    if data is None:
+        return GoBoard(), -1, 0, -1
+    content, last, changes, last_putter = data
+    return GoBoard.from_string(content or ''), last, changes, last_putter
+
+
+async def create_history_tables():
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('CREATE TABLE IF NOT EXISTS go_move ('
+                             'board_id INT, changes INT, parent INT, kind CHAR(1), `index` INT, stone CHAR(1), '
+                             'putter BIGINT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, '
+                             'PRIMARY KEY (board_id, changes))')
+        await cursor.execute('CREATE TABLE IF NOT EXISTS go_snapshot ('
+                             'board_id INT, changes INT, content CHAR(%s), last INT, '
+                             'PRIMARY KEY (board_id, changes))', (SIDE * SIDE,))
+        # boards older than the move log start their history from their current position
+        await cursor.execute('INSERT IGNORE INTO go_snapshot(board_id, changes, content, last) '
+                             'SELECT id, changes, content, last FROM go_board')
+        await database.commit()
+
+
+async def compare_and_set_board(id_: int, board: GoBoard, last: int, changes: int, last_putter: int,
+                                kind: str = PUT, parent: Optional[int] = None) -> bool:
+    """
+    stores the board only if its `changes` is still `changes`, and appends the change to the move log.
+
+    :param kind: `PUT`, `CLEAR` or `UNDO`
+    :param parent: change the new position comes after. `changes` by default
+    :return: whether the board was stored
+    """
+
+    content = board.to_string()
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('UPDATE go_board SET content = %s, last = %s, changes = changes + 1, last_putter = %s '
+                             'WHERE id = %s AND changes = %s',
+                             (content, last, last_putter, id_, changes))
+        if not cursor.rowcount and not changes:
+            await cursor.execute('INSERT IGNORE INTO go_board(id, content, last, changes, last_putter) '
+                                 'VALUES (%s, %s, %s, 1, %s)',
+                                 (id_, content, last, last_putter))
+        if not cursor.rowcount:
+            await database.rollback()
+            return False
+
+        await cursor.execute('INSERT INTO go_move(board_id, changes, parent, kind, `index`, stone, putter) '
+                             'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                             (id_, changes + 1, changes if parent is None else parent, kind, last,
+                              board[last] if last >= 0 else NONE, last_putter))
+        # jumps are always checkpointed, so replaying never has to go through one
+        if kind != PUT or (changes + 1) % SNAPSHOT_INTERVAL == 0:
+            await cursor.execute('INSERT INTO go_snapshot(board_id, changes, content, last) VALUES (%s, %s, %s, %s)',
+                                 (id_, changes + 1, content, last))
+        await database.commit()
+        return True
+
+
+async def modify_board(id_: int, last_putter: int, modify: Callable[[GoBoard], int],
+                       kind: str = PUT) -> Optional[tuple[GoBoard, int, int]]:
+    """
+    applies `modify` to the latest board and stores the result atomically,
+    retrying on the latest board if somebody else changed it meanwhile.
+
+    :param modify: changes the board in place and returns the index of the last move
+    :return: board, last and changes after the modification, or None if it kept conflicting
+    """
+
+    for _ in range(MODIFY_RETRIES):
+        board, _, changes, _ = await get_board_by_id(id_)
+        last = modify(board)
+        if await compare_and_set_board(id_, board, last, changes, last_putter, kind):
+            return board, last, changes + 1
+    return None
+
+
+async def get_moves(id_: int, since: int = 0, until: Optional[int] = None) -> tuple[tuple[int, int, str, int, str]]:
+    """
+    :return: (changes, parent, kind, index, stone) of moves in `(since, until]`, in order
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT changes, parent, kind, `index`, stone FROM go_move '
+                             'WHERE board_id = %s AND changes > %s AND changes <= %s ORDER BY changes',
+                             (id_, since, until if until is not None else 2 ** 31 - 1))
+        return await cursor.fetchall()
+
+
+async def get_board_at(id_: int, changes: int) -> Optional[tuple[GoBoard, int]]:
+    """
+    rebuilds the board right after `changes` from the latest snapshot at or before it,
+    replaying only the moves since then.
+
+    :return: board and last, or None if the log does not reach that position
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT changes, content, last FROM go_snapshot '
+                             'WHERE board_id = %s AND changes <= %s ORDER BY changes DESC LIMIT 1',
+                             (id_, changes))
+        snapshot = await cursor.fetchone()
+    since, content, last = snapshot if snapshot is not None else (0, '', -1)
+
+    moves = await get_moves(id_, since, changes)
+    if len(moves) != changes - since:
+        return None
+
+    board = GoBoard.from_string(content or '')
+    engine = None
+    for _, _, kind, index, stone in moves:
+        last = index
+        if stone == NONE:
+            board[index] = NONE
+            engine = None
+            continue
+        if engine is None:
+            engine = GoEngine(board)
+        engine.play(index, stone, superko=False)
+        board = engine.board
+    return GoBoard(bytearray(board.cells)), last
+
+
+async def get_undo_target(id_: int, changes: int) -> Optional[int]:
+    """
+    :return: change whose position `/go undo` goes back to, or None if the log does not reach it
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        while True:
+            await cursor.execute('SELECT parent, kind FROM go_move WHERE board_id = %s AND changes = %s',
+                                 (id_, changes))
+            if (move := await cursor.fetchone()) is None:
+                return None
+            parent, kind = move
+            if kind != UNDO:
+                return parent
+            # an undo shows the position of its parent, so undoing it again goes back from there
+            changes = parent
+
+
+def to_sgf_point(index: int) -> str:
+    return chr(ord('a') + index % SIDE) + chr(ord('a') + index // SIDE)
+
+
+async def export_sgf(id_: int, changes: int) -> Optional[str]:
+    """
+    writes the line of play leading to the board after `changes` as sgf.
+    the game starts from the last clear, or from the oldest logged position.
+    """
+
+    moves = {move[0]: move for move in await get_moves(id_, 0, changes)}
+
+    line = list()
+    version = changes
+    while (move := moves.get(version)) is not None and move[2] != CLEAR:
+        _, parent, kind, index, stone = move
+        if kind == PUT:
+            line.append((index, stone))
+        version = parent
+
+    if (start := await get_board_at(id_, version)) is None:
+        return None
+    board, _ = start
+
+    nodes = [f'(;GM[1]FF[4]CA[UTF-8]SZ[{SIDE}]GN[바둑판 #{id_}]']
+    for stone, name in ((BLACK, 'AB'), (WHITE, 'AW')):
+        if points := ''.join(f'[{to_sgf_point(i)}]' for i in range(SIDE * SIDE) if board[i] == stone):
+            nodes.append(name + points)
+    for index, stone in reversed(line):
+        if stone == NONE:
+            nodes.append(f';AE[{to_sgf_point(index)}]')
+        else:
+            nodes.append(f';{stone.upper()}[{to_sgf_point(index)}]')
+    return ''.join(nodes) + ')'
 
 
 def parse_place(place: str):
@@ -203,14 +732,43 @@ class GoCog(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
 
+        # lru of board id -> engine holding the superko history since it was built
+        self.engines: OrderedDict[int, GoEngine] = OrderedDict()
+        self.warm_up: Optional[Task] = None
+
+    async def cog_load(self):
+        await create_history_tables()
+
+    def get_engine(self, id_: int, board: GoBoard) -> GoEngine:
+        """returns the cached engine of the board, rebuilt if it does not match `board`."""
+
+        engine = self.engines.pop(id_, None)
+        if engine is None or engine.board.cells != board.cells:
+            engine = GoEngine(board)
+
+        self.engines[id_] = engine
+        while len(self.engines) > ENGINE_CAPACITY:
+            self.engines.popitem(last=False)
+        return engine
+
+    @Cog.listener()
+    async def on_ready(self):
+        # decoding tiles and drawing empty boards takes a while, so do it after startup but before anyone asks
+        if self.warm_up is None:
+            self.warm_up = create_task(to_thread(assets.warm_up, (get_const('go.size'),)))
+
     @go_group.command(name='show', description='현재 바둑판을 확인합니다.')
-    async def show(self, ctx: Interaction, id_: int = 0):
-        board, last, changes, last_putter = get_board_by_id(id_)
+    @app_commands.describe(size='한 칸의 크기입니다. 고해상도 이미지가 필요할 때만 크게 설정하세요.')
+    @app_commands.choices(size=[
+        app_commands.Choice(name='작게 (32px)', value=32),
+        app_commands.Choice(name='보통 (64px)', value=64),
+        app_commands.Choice(name='고해상도 (128px)', value=IMAGE_SIDE)])
+    async def show(self, ctx: Interaction, id_: int = 0, size: Optional[int] = None):
+        board, last, changes, last_putter = await get_board_by_id(id_)
 
         await ctx.response.defer()
 
-        image = create_image(board, last, id_)
-        image.save('res/go/tmp.png')
+        file = await get_board_file(id_, changes, board.to_string(), last, size)
 
         if last_putter is None or last_putter == -1:
             last_putter = ''
@@ -221,12 +779,10 @@ class GoCog(Cog):
 
         await ctx.edit_original_response(
             content=f'__{id_}번__ 바둑판을 확인합니다. {last_putter}',
-            attachments=[File('res/go/tmp.png', f'go_{id_}_{changes}.png')])
+            attachments=[file])
 
     @go_group.command(name='put', description='바둑판에 착수합니다.')
     async def put(self, ctx: Interaction, color: str, id_: int, place: str):
-        board, last, changes, _ = get_board_by_id(id_)
-
         x, y = parse_place(place)
         if y == -1 or x == -1:
             await ctx.response.send_message('입력한 위치가 올바르지 않습니다.', ephemeral=True)
@@ -240,12 +796,34 @@ class GoCog(Cog):
 
         await ctx.response.defer()
 
-        board = change_single(board, y, x, color)
-        changes += 1
-        update_board_by_id(id_, board, y * SIDE + x, changes, ctx.user.id)
+        captures = 0
+
+        def put_stone(board: GoBoard) -> int:
+            nonlocal captures
 
-        image = create_image(board, y * SIDE + x, id_)
-        image.save('res/go/tmp.png')
+            index = y * SIDE + x
+            if color == NONE:
+                # removing a stone by hand can split groups, so the engine is rebuilt on the next move
+                self.engines.pop(id_, None)
+                board[index] = color
+                return index
+
+            engine = self.get_engine(id_, board)
+            captures = engine.play(index, color)
+            board.cells[:] = engine.board.cells
+            return index
+
+        try:
+            result = await modify_board(id_, ctx.user.id, put_stone)
+        except IllegalMoveError as e:
+            await ctx.edit_original_response(content=f':x: {e}')
+            return
+        if result is None:
+            await ctx.edit_original_response(content=CONFLICT_MESSAGE)
+            return
+        board, last, changes = result
+
+        file = await get_board_file(id_, changes, board.to_string(), last)
 
         if color == WHITE:
             color = '백'
@@ -254,26 +832,92 @@ class GoCog(Cog):
         else:
             color = 'undefined'
 
-        filename = f'go_{id_}_{changes}.png'
         await ctx.edit_original_response(
-            content=f'__{ctx.user.name}__님이 __{id_}번 바둑판 **{place.upper()}**__에 __{color}__{eul_reul(color)} 착수했습니다.',
-            attachments=[File('res/go/tmp.png', filename)])
+            content=f'__{ctx.user.name}__님이 __{id_}번 바둑판 **{place.upper()}**__에 __{color}__{eul_reul(color)} 착수했습니다.'
+                    + (f' 돌 __{captures}개__를 따냈습니다.' if captures else ''),
+            attachments=[file])
+
+    @go_group.command(name='undo', description='바둑판의 마지막 변경을 되돌립니다.')
+    async def undo(self, ctx: Interaction, id_: int = 0):
+        await ctx.response.defer()
+
+        _, _, changes, _ = await get_board_by_id(id_)
+        if (target := await get_undo_target(id_, changes)) is None \
+                or (result := await get_board_at(id_, target)) is None:
+            await ctx.edit_original_response(content=':x: 더 이상 되돌릴 수 있는 변경이 없습니다.')
+            return
+        board, last = result
+
+        if not await compare_and_set_board(id_, board, last, changes, ctx.user.id, UNDO, target):
+            await ctx.edit_original_response(content=CONFLICT_MESSAGE)
+            return
+        self.engines.pop(id_, None)
+        changes += 1
+
+        file = await get_board_file(id_, changes, board.to_string(), last)
+        await ctx.edit_original_response(
+            content=f'__{ctx.user.name}__님이 __{id_}번__ 바둑판을 __{target}번째__ 변경 직후로 되돌렸습니다.',
+            attachments=[file])
+
+    @go_group.command(name='history', description='바둑판의 지난 배치를 확인합니다.')
+    @app_commands.describe(changes='확인할 변경 번호입니다.')
+    async def history(self, ctx: Interaction, id_: int, changes: int):
+        await ctx.response.defer()
+
+        if changes < 0 or (result := await get_board_at(id_, changes)) is None:
+            await ctx.edit_original_response(content=f':x: __{id_}번__ 바둑판의 __{changes}번째__ 변경 기록이 없습니다.')
+            return
+        board, last = result
+
+        file = await get_board_file(id_, changes, board.to_string(), last)
+        await ctx.edit_original_response(
+            content=f'__{id_}번__ 바둑판의 __{changes}번째__ 변경 직후 배치입니다.',
+            attachments=[file])
+
+    @go_group.command(name='sgf', description='바둑판의 기보를 SGF 파일로 내보냅니다.')
+    async def sgf(self, ctx: Interaction, id_: int = 0):
+        await ctx.response.defer()
+
+        _, _, changes, _ = await get_board_by_id(id_)
+        if (sgf := await export_sgf(id_, changes)) is None:
+            await ctx.edit_original_response(content=f':x: __{id_}번__ 바둑판의 기보를 만들 수 없습니다.')
+            return
+
+        await ctx.edit_original_response(
+            content=f'__{id_}번__ 바둑판의 기보입니다.',
+            attachments=[File(BytesIO(sgf.encode()), f'go_{id_}_{changes}.sgf')])
+
+    @go_group.command(name='cache', description='바둑판 이미지 캐시 상태를 확인합니다.')
+    async def cache(self, ctx: Interaction):
+        total = image_cache.hits + image_cache.misses
+        rate = image_cache.hits / total * 100 if total else 0
+        await ctx.response.send_message(
+            f'바둑판 이미지 캐시에 __{len(image_cache.images)}개__'
+            f'(__{image_cache.size / 1024 / 1024:,.2f} MiB__ / {get_const("go.cache_bytes") / 1024 / 1024:,.0f} MiB)의 '
+            f'이미지가 있습니다.\n'
+            f'* 적중: {image_cache.hits:,}회\n'
+            f'* 실패: {image_cache.misses:,}회\n'
+            f'* 적중률: {rate:.1f}%', ephemeral=True)
 
     @go_group.command(name='clear', description='바둑판을 초기화합니다.')
     async def clear(self, ctx: Interaction, id_: int = 0):
-        board, last, changes, _ = get_board_by_id(id_)
-
         await ctx.response.defer()
 
-        changes += 1
-        update_board_by_id(id_, '', -1, changes, id_)
+        def clear_board(board: GoBoard) -> int:
+            self.engines.pop(id_, None)
+            board.cells[:] = bytes(SIDE * SIDE)
+            return -1
+
+        if (result := await modify_board(id_, ctx.user.id, clear_board, CLEAR)) is None:
+            await ctx.edit_original_response(content=CONFLICT_MESSAGE)
+            return
+        board, last, changes = result
 
-        image = create_image('')
-        image.save('res/go/tmp.png')
+        file = await get_board_file(id_, changes, board.to_string(), last)
 
         await ctx.edit_original_response(
             content=f'__{id_}번__ 바둑판을 초기화했습니다.',
-            attachments=[File('res/go/tmp.png', f'go_{id_}_{changes}.png')])
+            attachments=[file])
 
 
 async def setup(bot: Bot):
@@ -1,15 +1,14 @@
-from asyncio import wait, TimeoutError as AsyncioTimeoutError
 from datetime import datetime
 from random import randint
 from typing import Any, Optional
 
-from discord import app_commands, Interaction, InteractionMessage
+from discord import app_commands, Interaction, ButtonStyle
 from discord.ext.commands import Cog, Bot
+from discord.ui import Button
 
-from util import get_const, check_reaction, custom_emoji
+from util import get_const, custom_emoji, prompt, reserve_prompt, release_prompt, get_prompt_message, \
+    PROMPT_LIMIT_MESSAGE
 from util.db import get_money, add_money, get_connection
-
-OX_EMOJIS = [get_const('emoji.x'), get_const('emoji.o')]
 DICE_EMOJI = [
     custom_emoji('die1', 1186274944422781019),
     custom_emoji('die2', 1186274946989694986),
@@ -22,32 +21,28 @@ DICE_EMOJI = [
 START_COST = 100_00  # cŁ
 
 
-def make_pig_row(user_id: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT IGNORE INTO pig(user_id) VALUES (%s)', (user_id,))
-        database.commit()
+async def make_pig_row(user_id: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT IGNORE INTO pig(user_id) VALUES (%s)', (user_id,))
+        await database.commit()
 
 
-def update_pig_score(user_id: int, score: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('UPDATE pig SET score = %s WHERE user_id = %s AND score < %s', (score, user_id, score))
-        database.commit()
+async def update_pig_score(user_id: int, score: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('UPDATE pig SET score = %s WHERE user_id = %s AND score < %s', (score, user_id, score))
+        await database.commit()
 
 
-def get_rank() -> tuple[tuple[int, int, ...], ...]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT user_id, score FROM pig ORDER BY score DESC LIMIT 10')
-        return cursor.fetchall()
+async def get_rank() -> tuple[tuple[int, int, ...], ...]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT user_id, score FROM pig ORDER BY score DESC LIMIT 10')
+        return await cursor.fetchall()
 
 
-def get_pig_score(user_id: int) -> Optional[int]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT score FROM pig WHERE user_id = %s', (user_id,))
-        data = cursor.fetchone()
+async def get_pig_score(user_id: int) -> Optional[int]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT score FROM pig WHERE user_id = %s', (user_id,))
+        data = await cursor.fetchone()
     return data[0] if data is not None else None
 
 
@@ -69,53 +64,57 @@ class MoneyAmusementPigCog(Cog):
 
     @pig_group.command(name='start', description=f'돼지 게임을 시작합니다. ({START_COST/100:,.2f} Ł)')
     async def start(self, ctx: Interaction):
-        # check have enough money or not
-        having = get_money(ctx.user.id)
-        if having < START_COST:
-            await ctx.response.send_message(
-                f'돼지 게임을 시작하기 위한 소지금이 부족합니다! 소지금이 __{START_COST/100:,.2f} Ł__ 필요합니다.')
+        # take the prompt slot before charging so the fee cannot be lost to the prompt limit
+        if not reserve_prompt(ctx.user.id):
+            await ctx.response.send_message(PROMPT_LIMIT_MESSAGE, ephemeral=True)
             return
-        add_money(ctx.user.id, -START_COST)
-
-        # process game
-        make_pig_row(ctx.user.id)
-        score = 0
-        template = f'현재 점수는 0점입니다. 주사위를 굴리시겠습니까? (60초)'
-        await ctx.response.send_message(template.format(score))
-        message: InteractionMessage = await ctx.original_response()
-        while True:
-            await message.clear_reactions()
-            await wait((message.add_reaction(get_const('emoji.x')), message.add_reaction(get_const('emoji.o'))))
-
-            try:
-                res = await self.bot.wait_for(
-                    'reaction_add',
-                    timeout=60.0,
-                    check=check_reaction(OX_EMOJIS, ctx, message.id))
-                await message.clear_reactions()
-            except AsyncioTimeoutError:
-                await message.edit(content=f':x: 시간이 초과되어 작업이 취소되었습니다. 참가비는 반환되지 않습니다.')
-                return
 
-            if res[0].emoji == get_const('emoji.x'):
-                break
-
-            die = randint(1, 6)
-            if die == 1:
-                await message.edit(content=f'{DICE_EMOJI[0]} {score}점에서 **1이 나와 점수가 초기화되었습니다.**')
+        try:
+            # check have enough money or not
+            having = await get_money(ctx.user.id)
+            if having < START_COST:
+                await ctx.response.send_message(
+                    f'돼지 게임을 시작하기 위한 소지금이 부족합니다! 소지금이 __{START_COST/100:,.2f} Ł__ 필요합니다.')
                 return
-
-            score += die
-            await message.edit(content=f'{DICE_EMOJI[die-1]} 점수가 **{score}점**이 되었습니다. '
-                                       f'한번 더 주사위를 굴리시겠습니까? (60초)')
-
-        update_pig_score(ctx.user.id, score)
-        await message.edit(content=f'{score}점으로 게임이 종료되었습니다!!')
+            await add_money(ctx.user.id, -START_COST)
+
+            # process game
+            await make_pig_row(ctx.user.id)
+            score = 0
+            content = f'현재 점수는 0점입니다. 주사위를 굴리시겠습니까? (60초)'
+            # a game can outlast the interaction token, so later rolls edit the message itself
+            message = None
+            while True:
+                choice = await prompt(ctx, content, [
+                    Button(emoji=get_const('emoji.x'), label='그만하기', style=ButtonStyle.secondary),
+                    Button(emoji=get_const('emoji.o'), label='굴리기', style=ButtonStyle.primary)],
+                    timeout_message=':x: 시간이 초과되어 작업이 취소되었습니다. 참가비는 반환되지 않습니다.',
+                    reserved=True, message=message)
+                if message is None:
+                    message = await get_prompt_message(ctx)
+                if choice is None:
+                    return
+
+                if choice == 0:
+                    break
+
+                die = randint(1, 6)
+                if die == 1:
+                    await message.edit(content=f'{DICE_EMOJI[0]} {score}점에서 **1이 나와 점수가 초기화되었습니다.**')
+                    return
+
+                score += die
+                content = f'{DICE_EMOJI[die-1]} 점수가 **{score}점**이 되었습니다. 한번 더 주사위를 굴리시겠습니까? (60초)'
+
+            await update_pig_score(ctx.user.id, score)
+            await message.edit(content=f'{score}점으로 게임이 종료되었습니다!!')
+        finally:
+            release_prompt(ctx.user.id)
 
     @pig_group.command(name='leaderboard', description=f'돼지 게임 최고 점수 순위를 확인합니다.')
     async def rank(self, ctx: Interaction):
         contents = list()
-        for user_id, score in get_rank():
+        for user_id, score in await get_rank():
             user = self.bot.get_user(user_id)
             if user is None:
                 user = f'||{user_id}||'
@@ -126,7 +125,7 @@ class MoneyAmusementPigCog(Cog):
 
     @pig_group.command(name='score', description='돼지게임 점수를 확인합니다.')
     async def score(self, ctx: Interaction):
-        score = get_pig_score(ctx.user.id)
+        score = await get_pig_score(ctx.user.id)
         if score is None:
             await ctx.response.send_message(
                 f'__{ctx.user.display_name}__님은 돼지게임을 플레이한 적이 없습니다.', ephemeral=True)
@@ -1,24 +1,32 @@
-import re
-from asyncio import sleep, TimeoutError as AsyncioTimeoutError
+from asyncio import sleep, gather, Lock
 from datetime import datetime, timedelta, timezone, date
 from math import inf, exp
 from random import randint, shuffle
 
-from discord import app_commands, Interaction, Member, Embed, Message
+from discord import app_commands, Interaction, Member, Embed, Message, ButtonStyle
 from discord.app_commands import command
 from discord.ext import tasks
 from discord.ext.commands import Cog, Bot
+from discord.ui import Button
 
-from util import get_const, parse_datetime, check_reaction, custom_emoji, generate_tax_message
+from util import get_const, parse_datetime, custom_emoji, generate_tax_message, prompt, reserve_prompt, \
+    release_prompt, PROMPT_LIMIT_MESSAGE
 from util.db import get_value, get_inventory, get_money, add_money, add_inventory, set_inventory, get_lotteries, \
-    set_value, clear_lotteries, get_streak_information, update_streak, get_streak_rank, add_money_with_tax
+    set_value, settle_lotteries, get_streak_information, update_streak, get_streak_rank, add_money_with_tax, \
+    get_lottery_draw, get_user_lotteries, get_lottery_count, add_lottery
 
 PREDICTION_FEE = 500  # cŁ
 LOTTERY_PRICE = 2000  # cŁ
 LOTTERY_NUMBER_RANGE = 100
 LOTTERY_COLOR = 0xfcba03
-LOTTERY_RE = re.compile(r'^로또: (\d{1,3}), (\d{1,3}), (\d{1,3}), (\d{1,3}), (\d{1,3}), (\d{1,3})$')
 LOTTERY_FEE_RATE = -0.1  # 수수료 비율
+LOTTERY_DM_BATCH = 5  # DMs sent per second after a draw
+# circular distance between two lottery numbers
+LOTTERY_DISTANCES = tuple(
+    tuple(min(abs(a - b), LOTTERY_NUMBER_RANGE - abs(a - b)) for b in range(LOTTERY_NUMBER_RANGE + 1))
+    for a in range(LOTTERY_NUMBER_RANGE + 1))
+# the nearest number is chosen by plain distance, then scored by circular distance
+LOTTERY_GAPS = tuple(tuple(abs(a - b) for b in range(LOTTERY_NUMBER_RANGE + 1)) for a in range(LOTTERY_NUMBER_RANGE + 1))
 INSTANT_LOTTERY_EMOJIS = [
     custom_emoji('vea1', 1136151830691332146),
     custom_emoji('vea5', 1136151832863965204),
@@ -30,15 +38,9 @@ INSTANT_LOTTERY_SELECTIONS = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️
 INSTANT_LOTTERY_RATES = [.25, .50, 1.0, 1.25, 2.0]
 
 
-async def validate_lottery_amount(ctx: Interaction, amount: int) -> bool:
+async def validate_lottery_amount(ctx: Interaction, draw: int, amount: int) -> bool:
     # get current lottery having amount
-    inventory = get_inventory(ctx.user.id)
-    lotteries = list()
-    now_having = 0
-    for item in inventory.items():
-        if item[0].startswith('로또: '):
-            lotteries.append(item)
-            now_having += item[1][0]
+    now_having = await get_lottery_count(draw, ctx.user.id)
 
     # check if amount is valid
     if now_having + amount > 10:
@@ -56,47 +58,67 @@ def generate_lottery_numbers() -> set[int]:
     return numbers
 
 
-def process_buy_lottery(user_id: int, lotto_set: set[int]) -> set[int]:
+async def process_buy_lottery(user_id: int, draw: int, lotto_set: set[int]) -> set[int]:
     # update database
-    add_money(user_id, -LOTTERY_PRICE)
-    add_inventory(user_id, f'로또: {", ".join(map(str, sorted(lotto_set)))}', 1, LOTTERY_PRICE)
+    await add_money(user_id, -LOTTERY_PRICE)
+    await add_lottery(draw, user_id, lotto_set, LOTTERY_PRICE)
     return lotto_set
 
 
-def calculate_lottery_similarity(lotto1: set[int], lotto2: set[int]) -> float:
+def format_lottery(numbers: set[int]) -> str:
+    return ', '.join(map(str, sorted(numbers)))
+
+
+def get_nearest_distances(numbers: set[int]) -> list[int]:
+    """
+    returns circular distance from every lottery number to its nearest number in `numbers`.
+    """
+
+    return [LOTTERY_DISTANCES[n][min(numbers, key=LOTTERY_GAPS[n].__getitem__)] for n in range(LOTTERY_NUMBER_RANGE + 1)]
+
+
+def calculate_lottery_similarity(win: set[int], win_distances: list[int], lotto: set[int]) -> float:
+    """
+    :param win: winning numbers
+    :param win_distances: `get_nearest_distances(win)`, computed once per draw
+    :param lotto: numbers of the ticket
+    """
+
     difference = 0
-    for number1 in lotto1:
-        number2 = min(lotto2, key=lambda x: abs(x - number1))
-        difference += min(abs(number1 - number2),
-                          abs(number1 - number2 - LOTTERY_NUMBER_RANGE),
-                          abs(number1 - number2 + LOTTERY_NUMBER_RANGE))
-    for number1 in lotto2:
-        number2 = min(lotto1, key=lambda x: abs(x - number1))
-        difference += min(abs(number1 - number2),
-                          abs(number1 - number2 - LOTTERY_NUMBER_RANGE),
-                          abs(number1 - number2 + LOTTERY_NUMBER_RANGE))
+    for number1 in win:
+        number2 = min(lotto, key=LOTTERY_GAPS[number1].__getitem__)
+        difference += LOTTERY_DISTANCES[number1][number2]
+    for number1 in lotto:
+        difference += win_distances[number1]
     # return (1 - difference / 400) ** 15
     return exp((-0.8 * difference + 92) / 20) / exp(92 / 20)
 
 
-def calculate_lottery_prices(win: set[int]):
+def group_lotteries(lotteries: list[tuple[int, set[int], int]]) -> dict[int, list[tuple[set[int], int]]]:
+    result = dict()
+    for user_id, numbers, amount in lotteries:
+        result.setdefault(user_id, list()).append((numbers, amount))
+    return result
+
+
+def calculate_lottery_prices(win: set[int], lotteries: dict[int, list[tuple[set[int], int]]]) -> dict[int, int]:
+    win_distances = get_nearest_distances(win)
+
     similarity_sum = 0
-    similarity_by_user: dict[int, list[float]] = dict()
+    similarity_by_user: dict[int, float] = dict()
     lottery_count = 0
-    for user_id, name, amount in get_lotteries():
-        numbers = set(map(int, LOTTERY_RE.match(name).groups()))
-        similarity = calculate_lottery_similarity(win, numbers)
-        similarity_sum += similarity
-        similarity_by_user[user_id] = similarity_by_user.get(user_id, list()) + [similarity]
-        lottery_count += amount
-
-        # print(f'{name} ({similarity})'
-        #         f' -> {similarity_by_user[user_id]} ({sum(similarity_by_user[user_id]) / similarity_sum * lottery_count})')
+    for user_id, user_lotteries in lotteries.items():
+        similarity_by_user[user_id] = 0
+        for numbers, amount in user_lotteries:
+            similarity = calculate_lottery_similarity(win, win_distances, numbers)
+            similarity_sum += similarity
+            similarity_by_user[user_id] += similarity
+            lottery_count += amount
 
     lottery_prize = lottery_count * LOTTERY_PRICE
     prices = dict()
-    for user_id, similarities in similarity_by_user.items():
-        prices[user_id] = round(sum(similarities) / similarity_sum * lottery_prize * (1 - LOTTERY_FEE_RATE))
+    for user_id, similarity in similarity_by_user.items():
+        prices[user_id] = round(similarity / similarity_sum * lottery_prize * (1 - LOTTERY_FEE_RATE))
 
     return prices
 
@@ -146,6 +168,12 @@ class MoneyAmusementsCog(Cog):
         ]
         """
 
+        self.draw = 0
+        self.lottery_lock = Lock()  # keeps purchases out of the draw being settled
+
+    async def cog_load(self):
+        self.draw = await get_lottery_draw()
+
     @Cog.listener()
     async def on_ready(self):
         self.lottery_tick.start()
@@ -153,8 +181,8 @@ class MoneyAmusementsCog(Cog):
     @ppl_group.command(name='check', description='로판파샤스의 금일 PPL 지수를 확인합니다.')
     async def ppl_check(self, ctx: Interaction, ephemeral: bool = True):
         # fetch ppl index from database
-        ppl_index = int(get_value(get_const('db.ppl')))
-        yesterday_ppl = int(get_value(get_const('db.yesterday_ppl')))
+        ppl_index = int(await get_value(get_const('db.ppl')))
+        yesterday_ppl = int(await get_value(get_const('db.yesterday_ppl')))
 
         # calculate multiplier
         try:
@@ -163,7 +191,7 @@ class MoneyAmusementsCog(Cog):
             multiplier = inf
 
         # calculate price of having ppl's
-        having, _ = get_inventory(ctx.user.id).get(get_const('db.ppl_having'), (0, 0))
+        having, _ = (await get_inventory(ctx.user.id)).get(get_const('db.ppl_having'), (0, 0))
         having_price = having * ppl_index * 100
 
         if multiplier > 1:
@@ -187,7 +215,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # fetch ppl index from database
-        ppl_index = int(get_value(get_const('db.ppl')))
+        ppl_index = int(await get_value(get_const('db.ppl')))
         price = amount * ppl_index * 100
 
         if ppl_index <= 0:
@@ -196,7 +224,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # check if user has enough money
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
         if having < price:
             await ctx.response.send_message(
                 f':x: 소지금이 부족합니다. '
@@ -206,11 +234,11 @@ class MoneyAmusementsCog(Cog):
             return
 
         # update database
-        add_money(ctx.user.id, -price)
-        add_inventory(ctx.user.id, get_const('db.ppl_having'), amount)
+        await add_money(ctx.user.id, -price)
+        await add_inventory(ctx.user.id, get_const('db.ppl_having'), amount)
 
-        now_having, _ = get_inventory(ctx.user.id).get(get_const('db.ppl_having'), (0, 0))
-        now_money = get_money(ctx.user.id)
+        now_having, _ = (await get_inventory(ctx.user.id)).get(get_const('db.ppl_having'), (0, 0))
+        now_money = await get_money(ctx.user.id)
         await ctx.response.send_message(
             f'PPL 상품 __{amount:,}__개를 구매했습니다. '
             f'현재 상품 당 PPL 가치는 __{ppl_index:,} Ł__이며, 총 __{now_having:,}__개를 소지하고 있습니다.\n'
@@ -223,7 +251,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # fetch ppl index from database
-        ppl_index = int(get_value(get_const('db.ppl')))
+        ppl_index = int(await get_value(get_const('db.ppl')))
         price = amount * ppl_index * 100
 
         # handle ppl_index == 0
@@ -234,7 +262,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # check if user has enough ppl
-        having, _ = get_inventory(ctx.user.id).get(get_const('db.ppl_having'), (0, 0))
+        having, _ = (await get_inventory(ctx.user.id)).get(get_const('db.ppl_having'), (0, 0))
         if_all = ''
         if having < amount:
             if_all = f'현재 소지하고 있는 PPL 상품은 총 __{having}__개입니다. 상품을 모두 판매합니다.\n'
@@ -242,12 +270,12 @@ class MoneyAmusementsCog(Cog):
             price = amount * ppl_index * 100
 
         # update database
-        non_tax, tax = add_money_with_tax(ctx.user.id, price)
+        non_tax, tax = await add_money_with_tax(ctx.user.id, price)
         tax_message = generate_tax_message(tax)
-        set_inventory(ctx.user.id, get_const('db.ppl_having'), having - amount)
+        await set_inventory(ctx.user.id, get_const('db.ppl_having'), having - amount)
 
-        now_having, _ = get_inventory(ctx.user.id).get(get_const('db.ppl_having'), (0, 0))
-        now_money = get_money(ctx.user.id)
+        now_having, _ = (await get_inventory(ctx.user.id)).get(get_const('db.ppl_having'), (0, 0))
+        now_money = await get_money(ctx.user.id)
         await ctx.response.send_message(
             f'{if_all}'
             f'PPL 상품 __{amount:,}__개를 판매하여 __**{price / 100:,.2f} Ł**__를 벌었습니다. {tax_message}'
@@ -276,7 +304,7 @@ class MoneyAmusementsCog(Cog):
 
     async def handle_bet(self, ctx: Interaction, dealer: Member, amount: int):
         # check if user has enough money
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
         if having < amount:
             await ctx.response.send_message(
                 f':x: 소지금이 부족합니다. '
@@ -285,7 +313,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # update database
-        add_money(ctx.user.id, -amount)
+        await add_money(ctx.user.id, -amount)
         if dealer.id not in self.bets:
             self.bets[dealer.id] = dict()
         if ctx.user.id not in self.bets[dealer.id]:
@@ -332,7 +360,7 @@ class MoneyAmusementsCog(Cog):
         total_bet = sum(self.bets[ctx.user.id].values())
 
         # update database
-        non_tax, tax = add_money_with_tax(to.id, total_bet)
+        non_tax, tax = await add_money_with_tax(to.id, total_bet)
         tax_message = generate_tax_message(tax)
         self.bets.pop(ctx.user.id)
 
@@ -370,44 +398,48 @@ class MoneyAmusementsCog(Cog):
     async def lottery_tick(self):
         # check new day
         last_record = datetime.now(timezone.utc)
-        previous = parse_datetime(get_value('lottery.last_record'))
+        previous = parse_datetime(await get_value('lottery.last_record'))
         # if not yet 7 days passed, return
         if previous is not None and (last_record - previous).days < 7:
             return
-        set_value('lottery.last_record', str(last_record))
+        await set_value('lottery.last_record', str(last_record))
 
-        # log lottery
-        win = generate_lottery_numbers()
-        prices = calculate_lottery_prices(win)
+        # draw and settle every prize in one transaction
+        async with self.lottery_lock:
+            draw = self.draw
+            win = generate_lottery_numbers()
+            lotteries = group_lotteries(await get_lotteries(draw))
+            prices = calculate_lottery_prices(win, lotteries)
+            payouts = await settle_lotteries(draw, prices)
+            self.draw = draw + 1  # lotteries bought from now on take part in the next draw
         now = datetime.now(timezone.utc)
         result_message = f'{now.year}년 {now.month}월 {now.day}일: 로또 번호가 추첨되었습니다.'
 
+        # send result message
+        text_channel = self.bot.get_channel(get_const('channel.general'))
+        await text_channel.send(result_message, embed=get_lottery_embed(prices, win, now))
+
         # send message per user
+        messages = list()
         for user_id, price in prices.items():
-            await sleep(0)
             user = self.bot.get_user(user_id)
             if user is None:
                 continue
 
-            lotteries = filter(lambda x: x[0] == user_id, get_lotteries())
-
-            # database update
-            non_tax, tax = add_money_with_tax(user_id, price)
-
-            # send message
+            non_tax, tax = payouts[user_id]
             embed = get_lottery_embed(prices, win, now)
-            embed.add_field(
-                name='구매한 로또 목록', value='\n'.join(map(lambda x: f'{x[1]} ({x[2]}개)', lotteries)), inline=False)
+            embed.add_field(name='구매한 로또 목록',
+                            value='\n'.join(map(lambda x: f'{format_lottery(x[0])} ({x[1]}개)', lotteries[user_id])),
+                            inline=False)
             embed.add_field(name='총 당첨 금액', value=f'{price / 100:,.2f} Ł', inline=False)
             embed.add_field(name='지급 금액', value=f'**{non_tax / 100:,.2f} Ł**', inline=False)
             embed.add_field(name='세금 자동 납부', value=f'{tax / 100:,.2f} Ł', inline=False)
-            await user.send(result_message, embed=embed)
+            messages.append(user.send(result_message, embed=embed))
 
-        clear_lotteries()
-
-        # send result message
-        text_channel = self.bot.get_channel(get_const('channel.general'))
-        await text_channel.send(result_message, embed=get_lottery_embed(prices, win, now))
+        # stay under the rate limit of opening DM channels
+        for i in range(0, len(messages), LOTTERY_DM_BATCH):
+            await gather(*messages[i:i + LOTTERY_DM_BATCH], return_exceptions=True)
+            await sleep(1)
 
     @prediction_group.command(name='start', description=f'예측 세션을 시작합니다. {PREDICTION_FEE / 100:,.2f}Ł가 소모됩니다.')
     async def prediction_start(self, ctx: Interaction, title: str, option1: str, option2: str,
@@ -423,7 +455,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # check if user has enough money
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
         if having < PREDICTION_FEE:
             await ctx.response.send_message(
                 f':x: 소지금이 부족합니다. '
@@ -432,7 +464,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # update database
-        add_money(ctx.user.id, -PREDICTION_FEE)
+        await add_money(ctx.user.id, -PREDICTION_FEE)
 
         until = datetime.now() + timedelta(seconds=duration_second)
         prediction = (title, option1, option2, until, dict(), dict())
@@ -475,7 +507,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # check if user has enough money
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
         if having < amount:
             await ctx.response.send_message(
                 f':x: 소지금이 부족합니다. '
@@ -499,7 +531,7 @@ class MoneyAmusementsCog(Cog):
             return
 
         # update database
-        add_money(ctx.user.id, -amount)
+        await add_money(ctx.user.id, -amount)
         index = 4 if option == 1 else 5
         self.predictions[dealer.id][index][ctx.user.id] = self.predictions[dealer.id][index].get(ctx.user.id,
                                                                                                  0) + amount
@@ -536,7 +568,7 @@ class MoneyAmusementsCog(Cog):
         try:
             multiplier = total_betting / (option1_betting if winner_is_option_1 else option2_betting)
         except ZeroDivisionError:
-            add_money_with_tax(ctx.user.id, total_betting)
+            await add_money_with_tax(ctx.user.id, total_betting)
             await ctx.response.send_message(
                 message + '\n> 승리 옵션의 베팅 금액이 없으므로 베팅 진행자가 베팅 금액을 모두 가져갑니다.',
                 embed=self.get_prediction_info(ctx.user.id))
@@ -545,7 +577,7 @@ class MoneyAmusementsCog(Cog):
 
         # update database
         for user_id, amount in self.predictions[ctx.user.id][4 if winner_is_option_1 else 5].items():
-            add_money_with_tax(user_id, round(amount * multiplier))
+            await add_money_with_tax(user_id, round(amount * multiplier))
 
         # send message
         await ctx.response.send_message(message, embed=self.get_prediction_info(ctx.user.id))
@@ -567,22 +599,23 @@ class MoneyAmusementsCog(Cog):
         if amount <= 0:
             await ctx.response.send_message(':x: 구매할 로또의 개수는 0보다 커야 합니다.', ephemeral=True)
             return
-        if await validate_lottery_amount(ctx, amount):
-            return
+        async with self.lottery_lock:
+            if await validate_lottery_amount(ctx, self.draw, amount):
+                return
 
-        # check if having enough money
-        having = get_money(ctx.user.id)
-        if having < LOTTERY_PRICE * amount:
-            await ctx.response.send_message(
-                f':x: 로또 {amount}개를 구매하기에 충분한 돈이 없습니다. '
-                f'(현재 __{having / 100:,.2f} Ł__ 보유중입니다.)', ephemeral=True)
-            return
+            # check if having enough money
+            having = await get_money(ctx.user.id)
+            if having < LOTTERY_PRICE * amount:
+                await ctx.response.send_message(
+                    f':x: 로또 {amount}개를 구매하기에 충분한 돈이 없습니다. '
+                    f'(현재 __{having / 100:,.2f} Ł__ 보유중입니다.)', ephemeral=True)
+                return
 
-        # process buy
-        bought = list()
-        for _ in range(amount):
-            lottery = process_buy_lottery(ctx.user.id, generate_lottery_numbers())
-            bought.append(lottery)
+            # process buy
+            bought = list()
+            for _ in range(amount):
+                lottery = await process_buy_lottery(ctx.user.id, self.draw, generate_lottery_numbers())
+                bought.append(lottery)
 
         # send message
         await ctx.response.send_message(
@@ -591,15 +624,12 @@ class MoneyAmusementsCog(Cog):
             embed=Embed(
                 title='구매한 로또',
                 description='\n'.join(
-                    f'**{i + 1}**. {", ".join(map(str, sorted(lotto)))}' for i, lotto in enumerate(bought)),
+                    f'**{i + 1}**. {format_lottery(lotto)}' for i, lotto in enumerate(bought)),
                 color=LOTTERY_COLOR))
 
     @lottery_group.command(
         name='buy', description=f'로또를 구매합니다. 로또는 한 장에 {LOTTERY_PRICE / 100:,.2f} Ł입니다.')
     async def lottery_buy(self, ctx: Interaction, a: int, b: int, c: int, d: int, e: int, f: int):
-        if await validate_lottery_amount(ctx, 1):
-            return
-
         # check lottery validity
         lottery_set = {a, b, c, d, e, f}
         if len(lottery_set) != 6:
@@ -613,7 +643,10 @@ class MoneyAmusementsCog(Cog):
                                                 ephemeral=True)
                 return
 
-        lottery = process_buy_lottery(ctx.user.id, lottery_set)
+        async with self.lottery_lock:
+            if await validate_lottery_amount(ctx, self.draw, 1):
+                return
+            lottery = await process_buy_lottery(ctx.user.id, self.draw, lottery_set)
 
         # send message
         await ctx.response.send_message(
@@ -621,14 +654,30 @@ class MoneyAmusementsCog(Cog):
             f'(총 __**{LOTTERY_PRICE / 100:,.2f} Ł**__)',
             embed=Embed(
                 title='구매한 로또',
-                description=f'{", ".join(map(str, sorted(lottery)))}',
+                description=format_lottery(lottery),
                 color=LOTTERY_COLOR))
 
+    @lottery_group.command(name='list', description='구매한 로또 목록을 확인합니다.')
+    async def lottery_list(self, ctx: Interaction):
+        lotteries = await get_user_lotteries(self.draw, ctx.user.id)
+
+        if not lotteries:
+            await ctx.response.send_message('구매한 로또가 없습니다.', ephemeral=True)
+            return
+
+        await ctx.response.send_message(
+            f'__{ctx.user}__님은 이번 회차 로또를 총 __{sum(map(lambda x: x[1], lotteries))}개__ 가지고 있습니다.',
+            embed=Embed(
+                title='구매한 로또',
+                description='\n'.join(f'* {format_lottery(numbers)} ({amount}개)' for numbers, amount in lotteries),
+                color=LOTTERY_COLOR),
+            ephemeral=True)
+
     @command(
         name='instant', description=f'즉석 복권을 발행합니다. 즉석 복권의 기대치는 100%입니다.')
     async def instant(self, ctx: Interaction, price: float):
         price = round(price * 100)
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
 
         # check if user has enough money
         if price > having * 0.1:
@@ -642,55 +691,54 @@ class MoneyAmusementsCog(Cog):
             await ctx.response.send_message(':x: 0원 이상만 구매할 수 있습니다.')
             return
 
-        add_money(ctx.user.id, -price)
-
-        # make lottery
-        lottery = list(range(5))
-        shuffle(lottery)
-
-        for i in range(5):
-            lottery[i] = (INSTANT_LOTTERY_RATES[lottery[i]], INSTANT_LOTTERY_EMOJIS[lottery[i]])
-
-        # make embed for lottery scratching
-        embed = Embed(title='즉석 복권 발행',
-                      description=f'__{ctx.user}__님이 __{price / 100:,.2f} Ł__ 상당의 즉석 복권을 발행했습니다.',
-                      colour=LOTTERY_COLOR)
-        embed.add_field(name='복권',
-                        value=':orange_square: :orange_square: :orange_square: :orange_square: :orange_square:',
-                        inline=False)
-        embed.add_field(name='복권 당첨금 비율',
-                        value='\n'.join(f'* {INSTANT_LOTTERY_EMOJIS[i]}: {INSTANT_LOTTERY_RATES[i] * 100:.0f}% '
-                                        f'({price * INSTANT_LOTTERY_RATES[i] / 100:,.2f} Ł)' for i in range(5)),
-                        inline=False)
-        await ctx.response.send_message(
-            '5개의 버튼 중 하나를 1분 안에 눌러주세요. 선택을 진행하지 않으면 복권 발행이 취소되고 발행 비용이 반환되지 않습니다.',
-            embed=embed)
-        message = await ctx.original_response()
-
-        for emoji in INSTANT_LOTTERY_SELECTIONS:
-            await message.add_reaction(emoji)
+        # take the prompt slot before charging so the fee cannot be lost to the prompt limit
+        if not reserve_prompt(ctx.user.id):
+            await ctx.response.send_message(PROMPT_LIMIT_MESSAGE, ephemeral=True)
+            return
 
-        # wait for reaction added
         try:
-            res = await self.bot.wait_for('reaction_add',
-                                          check=check_reaction(INSTANT_LOTTERY_SELECTIONS, ctx, message.id),
-                                          timeout=60.0)
-        except AsyncioTimeoutError:
-            await message.edit(content=':x: 시간이 초과되어 작업이 취소되었습니다. 복권 발행 비용은 반환되지 않습니다.',
-                               embed=None)
-            return
+            await add_money(ctx.user.id, -price)
+
+            # make lottery
+            lottery = list(range(5))
+            shuffle(lottery)
+
+            for i in range(5):
+                lottery[i] = (INSTANT_LOTTERY_RATES[lottery[i]], INSTANT_LOTTERY_EMOJIS[lottery[i]])
+
+            # make embed for lottery scratching
+            embed = Embed(title='즉석 복권 발행',
+                          description=f'__{ctx.user}__님이 __{price / 100:,.2f} Ł__ 상당의 즉석 복권을 발행했습니다.',
+                          colour=LOTTERY_COLOR)
+            embed.add_field(name='복권',
+                            value=':orange_square: :orange_square: :orange_square: :orange_square: :orange_square:',
+                            inline=False)
+            embed.add_field(name='복권 당첨금 비율',
+                            value='\n'.join(f'* {INSTANT_LOTTERY_EMOJIS[i]}: {INSTANT_LOTTERY_RATES[i] * 100:.0f}% '
+                                            f'({price * INSTANT_LOTTERY_RATES[i] / 100:,.2f} Ł)' for i in range(5)),
+                            inline=False)
+            index = await prompt(
+                ctx,
+                '5개의 버튼 중 하나를 1분 안에 눌러주세요. 선택을 진행하지 않으면 복권 발행이 취소되고 발행 비용이 반환되지 않습니다.',
+                [Button(emoji=emoji, style=ButtonStyle.secondary) for emoji in INSTANT_LOTTERY_SELECTIONS],
+                embed=embed,
+                timeout_message=':x: 시간이 초과되어 작업이 취소되었습니다. 복권 발행 비용은 반환되지 않습니다.',
+                reserved=True)
+            if index is None:
+                return
 
-        # send and apply result
-        index = INSTANT_LOTTERY_SELECTIONS.index(res[0].emoji)
-        win = round(price * lottery[index][0])
-        non_tax, tax = add_money_with_tax(ctx.user.id, win)
-        tax_message = generate_tax_message(tax)
+            # send and apply result
+            win = round(price * lottery[index][0])
+            non_tax, tax = await add_money_with_tax(ctx.user.id, win)
+            tax_message = generate_tax_message(tax)
 
-        embed.set_field_at(0, name='복권', value=' '.join(map(lambda x: x[1], lottery)), inline=False)
-        embed.add_field(name='결과', value=f'{lottery[index][1]} - __**{win / 100:,.2f} Ł** 당첨__')
-        await message.edit(content=f'__**{index + 1}**__번을 선택했습니다. 당첨금은 __**{win / 100:,.2f} Ł**__입니다. '
-                                   f'{tax_message}',
-                           embed=embed)
+            embed.set_field_at(0, name='복권', value=' '.join(map(lambda x: x[1], lottery)), inline=False)
+            embed.add_field(name='결과', value=f'{lottery[index][1]} - __**{win / 100:,.2f} Ł** 당첨__')
+            await ctx.edit_original_response(
+                content=f'__**{index + 1}**__번을 선택했습니다. 당첨금은 __**{win / 100:,.2f} Ł**__입니다. {tax_message}',
+                embed=embed)
+        finally:
+            release_prompt(ctx.user.id)
 
     @attend_group.command(name='check', description='로판파샤스에 출석합니다.')
     async def attend_check(self, ctx: Interaction):
@@ -698,7 +746,7 @@ class MoneyAmusementsCog(Cog):
         yesterday = today - timedelta(days=1)
 
         try:
-            streak, last_attend, max_streak = get_streak_information(ctx.user.id)
+            streak, last_attend, max_streak = await get_streak_information(ctx.user.id)
         except IndexError:
             streak = 0
             last_attend = None
@@ -715,16 +763,16 @@ class MoneyAmusementsCog(Cog):
 
         max_streak = max(now_streak, max_streak)
 
-        non_tax, tax = add_money_with_tax(ctx.user.id, now_streak * 100)
+        non_tax, tax = await add_money_with_tax(ctx.user.id, now_streak * 100)
         tax_message = generate_tax_message(tax)
-        update_streak(ctx.user.id, now_streak, today, max_streak)
+        await update_streak(ctx.user.id, now_streak, today, max_streak)
         await ctx.response.send_message(f'__{today}__ 출석을 확인했습니다. 현재 스트릭은 __**{now_streak}일**__, '
                                         f'최고 스트릭은 __{max_streak}일__입니다. '
                                         f'__{now_streak:,.2f} Ł__를 획득했습니다. {tax_message}:sunglasses:')
 
     @attend_group.command(name='rank', description='출석 순위를 확인합니다.')
     async def attend_rank(self, ctx: Interaction):
-        streak_rank = get_streak_rank()
+        streak_rank = await get_streak_rank()
 
         rows = list()
         for (user_id, streak) in streak_rank:
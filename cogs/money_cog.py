@@ -1,34 +1,40 @@
-from asyncio import sleep, TimeoutError as AsyncioTimeoutError, wait
+from asyncio import sleep
 from datetime import datetime, timezone, timedelta
+from time import perf_counter
 from typing import Optional
 
 from discord import NotFound, Member, VoiceState, InteractionMessage, RawReactionActionEvent, Interaction, Embed, \
-    VoiceChannel, Reaction
+    VoiceChannel
 from discord.app_commands import command, Choice, Group, MissingRole
-from discord.app_commands.checks import has_role
 from discord.ext import tasks
 from discord.ext.commands import Cog, Bot
+from numpy import ndarray, fromiter, power, where, rint
 
-from cogs.admin_cog import OX_EMOJIS
-from util import parse_timedelta, get_const, parse_datetime, eul_reul, check_reaction, generate_tax_message
+from util import parse_timedelta, get_const, parse_datetime, eul_reul, generate_tax_message, confirm, \
+    has_const_role
 from util.db import get_value, set_value, add_money, get_money, get_inventory, get_money_ranking, set_inventory, \
-    get_tax, add_tax, add_money_with_tax, get_everyone_id, get_total_inventory_value, add_ppl_history, add_issue_history
+    get_tax, add_tax, add_money_with_tax, get_total_inventory_value, add_ppl_history, add_issue_history, \
+    increase_value, flush_values, add_reward, flush_rewards, get_assets, add_taxes, get_total_lottery_value
 
 MONEY_CHECK_FEE = 50
+FLUSH_INTERVAL = 30  # seconds
+CALL_REWARD = 5  # cŁ per minute; 지급 기준 변경 시 readme.md 수정 필요
+CALL_REWARD_CHECKPOINT = 5  # minutes
 
 
-def get_asset(user_id):
-    wallet = get_money(user_id)
+async def get_asset(user_id):
+    wallet = await get_money(user_id)
 
-    inventory = get_total_inventory_value(user_id)
+    inventory = await get_total_inventory_value(user_id)
+    lotteries = await get_total_lottery_value(user_id)
 
-    ppl_price = int(get_value(get_const('db.ppl'))) * 100
-    ppl_having, _ = get_inventory(user_id).get(get_const('db.ppl_having'), (0, 0))
+    ppl_price = int(await get_value(get_const('db.ppl'))) * 100
+    ppl_having, _ = (await get_inventory(user_id)).get(get_const('db.ppl_having'), (0, 0))
     ppls = ppl_having * ppl_price
 
-    tax = get_tax(user_id)
+    tax = await get_tax(user_id)
 
-    return wallet + inventory + ppls - tax
+    return wallet + inventory + lotteries + ppls - tax
 
 
 def calculate_tax(x: float) -> float:
@@ -44,11 +50,20 @@ def calculate_tax(x: float) -> float:
     return float(result)
 
 
-def get_issue() -> int:
-    issue = 0
-    for user_id in get_everyone_id():
-        issue += get_asset(user_id)
-    return issue
+def calculate_taxes(x: ndarray) -> ndarray:
+    """
+    vectorized `calculate_tax`.
+
+    :param x: asset amounts in centilos
+    :return: taxes in centilos
+    """
+    assets = x / 100
+    result = (assets - 1_000_000 * (1 - power(0.999, 0.9 * assets / 1000))) * 100
+    return where(x > 0, result, 0.0)
+
+
+async def get_issue() -> int:
+    return sum((await get_assets()).values())
 
 
 class MoneyCog(Cog):
@@ -60,24 +75,61 @@ class MoneyCog(Cog):
 
         self.today_people = set()
         self.message_logs: dict[int, int] = dict()
-        self.voice_people = set()
+        # member id -> start of the call time not yet rewarded
+        self.voice_people: dict[int, datetime] = dict()
 
     @staticmethod
-    async def collect_taxes():
-        ids = list(get_everyone_id())
-        for i, member_id in enumerate(ids):
-            asset = get_asset(member_id)
-
-            if asset <= 0:
+    async def collect_taxes(month: str, force: bool = False) -> Optional[tuple[int, int, float]]:
+        """
+        collects taxes of every account once per `month`.
+
+        :return: number of taxed accounts, total tax and elapsed seconds. None if already collected.
+        """
+        start = perf_counter()
+
+        assets = await get_assets()
+        print(f'Tax collection {month}: fetched {len(assets)} assets ({perf_counter() - start:.3f}s)')
+
+        taxes = rint(calculate_taxes(fromiter(assets.values(), float, len(assets))))
+        collected = {user_id: int(tax) for user_id, tax in zip(assets, taxes) if tax > 0}
+        total = sum(collected.values())
+        print(f'Tax collection {month}: calculated {len(collected)} taxes ({perf_counter() - start:.3f}s)')
+
+        if not await add_taxes(collected, month, force):
+            print(f'Tax collection {month}: already collected')
+            return None
+
+        elapsed = perf_counter() - start
+        print(f'Tax collection {month}: collected {total / 100:,.2f} Ł ({elapsed:.3f}s)')
+        return len(collected), total, elapsed
+
+    def accrue_call_rewards(self, *member_ids: int):
+        """
+        moves rewards for whole minutes spent in voice channels to the reward ledger.
+        the remaining seconds are kept for the next accrual.
+        """
+        now = datetime.now(timezone.utc)
+        for member_id in member_ids:
+            since = self.voice_people[member_id]
+            minutes = (now - since) // timedelta(minutes=1)
+            if minutes <= 0:
                 continue
 
-            tax = calculate_tax(asset)
-            add_tax(member_id, round(tax))
+            self.voice_people[member_id] = since + timedelta(minutes=minutes)
+            add_reward(member_id, minutes * CALL_REWARD)
+
+    async def cog_unload(self):
+        self.flush_pending.cancel()
+        self.checkpoint_call_rewards.cancel()
+        self.accrue_call_rewards(*self.voice_people)
+        await flush_values()
+        await flush_rewards()
 
     @Cog.listener()
     async def on_ready(self):
         self.today_statistics.start()
-        self.give_money_if_call.start()
+        self.checkpoint_call_rewards.start()
+        self.flush_pending.start()
 
     @Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
@@ -87,9 +139,11 @@ class MoneyCog(Cog):
         if member.guild.id == get_const('guild.lofanfashasch'):
             if after.channel is None:
                 if member.id in self.voice_people:
-                    self.voice_people.remove(member.id)
+                    self.accrue_call_rewards(member.id)
+                    self.voice_people.pop(member.id)
+                    await flush_rewards()
             if before.channel is None:
-                self.voice_people.add(member.id)
+                self.voice_people[member.id] = datetime.now(timezone.utc)
 
     @Cog.listener()
     async def on_message(self, message: InteractionMessage):
@@ -98,10 +152,8 @@ class MoneyCog(Cog):
         # record today statistics
         try:
             if message.guild.id == lofanfashasch_id:
-                today_messages = int(get_value('today_messages'))
-                set_value('today_messages', today_messages + 1)
-                today_messages_length = int(get_value('today_messages_length'))
-                set_value('today_messages_length', today_messages_length + len(message.content))
+                increase_value('today_messages')
+                increase_value('today_messages_length', len(message.content))
                 self.today_people.add(message.author.id)
         except AttributeError:
             pass
@@ -110,7 +162,8 @@ class MoneyCog(Cog):
         try:
             if message.guild.id == lofanfashasch_id and (amount := len(set(message.content))):
                 # 지급 기준 변경 시 readme.md 수정 필요
-                add_money_with_tax(message.author.id, amount)
+                if add_reward(message.author.id, amount):
+                    await flush_rewards()
         except AttributeError:
             pass
 
@@ -118,37 +171,40 @@ class MoneyCog(Cog):
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
         # record today statistics
         if payload.guild_id == get_const('guild.lofanfashasch'):
-            today_reactions = get_value('today_reactions')
-            set_value('today_reactions', int(today_reactions) + 1)
+            increase_value('today_reactions')
             self.today_people.add(payload.user_id)
 
-    @tasks.loop(minutes=1)
-    async def give_money_if_call(self):
-        for member_id in self.voice_people:
-            # 지급 기준 변경 시 readme.md 수정 필요
-            add_money_with_tax(member_id, 5)
+    @tasks.loop(minutes=CALL_REWARD_CHECKPOINT)
+    async def checkpoint_call_rewards(self):
+        self.accrue_call_rewards(*self.voice_people)
+        await flush_rewards()
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flush_pending(self):
+        await flush_values()
+        await flush_rewards()
 
     @tasks.loop(minutes=1)
     async def today_statistics(self):
         last_record = datetime.now(timezone.utc)
 
         # check new day
-        previous = parse_datetime(get_value('last_record'))
+        previous = parse_datetime(await get_value('last_record'))
         # if same day, do nothing
         if previous.day == last_record.day:
             return
 
-        set_value('last_record', str(last_record))
+        await set_value('last_record', str(last_record))
 
         # record ppl on database
-        previous_ppl = int(get_value(get_const('db.ppl')))
-        set_value(get_const('db.ppl'), str(len(self.today_people)))
-        set_value(get_const('db.yesterday_ppl'), str(previous_ppl))
-        add_ppl_history(last_record.date(), len(self.today_people))
+        previous_ppl = int(await get_value(get_const('db.ppl')))
+        await set_value(get_const('db.ppl'), str(len(self.today_people)))
+        await set_value(get_const('db.yesterday_ppl'), str(previous_ppl))
+        await add_ppl_history(last_record.date(), len(self.today_people))
 
         # record issue on database
-        issue = get_issue()
-        add_issue_history(last_record, issue)
+        issue = await get_issue()
+        await add_issue_history(last_record, issue)
 
         # get server and send statistics message
         text_channel = self.bot.get_channel(get_const('channel.general'))
@@ -156,17 +212,16 @@ class MoneyCog(Cog):
         await text_channel.send(f'# `{previous.date()}`의 통계\n{await self.generate_today_statistics()}')
 
         # collect taxes if it's first day of the month
-        if last_record.day == 1:
-            await self.collect_taxes()
+        if last_record.day == 1 and await self.collect_taxes(f'{last_record.year}-{last_record.month:02d}'):
             await text_channel.send(f'# 세금 징수 공지\n월 1일이 되어 세금이 징수되었습니다. '
                                     f'`/tax check`를 통해 세금을 확인하고 `/tax pay`를 통해 세금을 납세해주세요. @everyone')
 
         # reset
-        set_value('today_messages', 0)
-        set_value('today_messages_length', 0)
-        set_value('today_calls', 0)
-        set_value('today_call_duration', timedelta())
-        set_value('today_reactions', 0)
+        await set_value('today_messages', 0)
+        await set_value('today_messages_length', 0)
+        await set_value('today_calls', 0)
+        await set_value('today_call_duration', timedelta())
+        await set_value('today_reactions', 0)
         self.today_people.clear()
 
     async def voice_channel_notification(self, member: Member, before: VoiceState, after: VoiceState):
@@ -201,8 +256,8 @@ class MoneyCog(Cog):
                                         f'(활성 시간: {duration}, {message.jump_url})')
             else:
                 await message.delete()
-            today_call_duration = parse_timedelta(get_value('today_call_duration'))
-            set_value('today_call_duration', today_call_duration + duration)
+            today_call_duration = parse_timedelta(await get_value('today_call_duration'))
+            await set_value('today_call_duration', today_call_duration + duration)
 
             return
 
@@ -225,14 +280,13 @@ class MoneyCog(Cog):
         message = await text_channel.send(content)
         self.message_logs[after.channel.id] = message.id
 
-        today_calls = int(get_value('today_calls'))
-        set_value('today_calls', today_calls + 1)
+        increase_value('today_calls')
 
     async def generate_today_statistics(self) -> str:
         await sleep(0)
 
         # calculate total call duration
-        call_duration = parse_timedelta(get_value('today_call_duration'))
+        call_duration = parse_timedelta(await get_value('today_call_duration'))
         # add current call duration
         now = datetime.now(timezone.utc)
         for message_id in self.message_logs.values():
@@ -244,10 +298,10 @@ class MoneyCog(Cog):
             call_duration += now - message.created_at
 
         # make formatted string
-        today_messages = get_value('today_messages')
-        today_messages_length = get_value('today_messages_length')
-        today_calls = get_value('today_calls')
-        today_reactions = get_value('today_reactions')
+        today_messages = await get_value('today_messages')
+        today_messages_length = await get_value('today_messages_length')
+        today_calls = await get_value('today_calls')
+        today_reactions = await get_value('today_reactions')
         return f'* `{today_messages}`개의 메시지가 전송되었습니다. (총 길이: `{today_messages_length}`문자)\n' \
                f'* 음성 채널이 `{today_calls}`번 활성화되었습니다.\n' \
                f'  * 총 통화 길이는 `{call_duration}`입니다.\n' \
@@ -297,29 +351,29 @@ class MoneyCog(Cog):
         # fee
         feed = ''
         if member.id != ctx.user.id:
-            having = get_money(ctx.user.id)
+            having = await get_money(ctx.user.id)
             if having < MONEY_CHECK_FEE:
                 await ctx.response.send_message(f':x: 소지금이 부족하여 다른 사람의 소지금을 확인할 수 없습니다. '
                                                 f'(현재 {having / 100:,.2f} Ł)', ephemeral=ephemeral)
                 return
 
-            add_money(ctx.user.id, -MONEY_CHECK_FEE)
+            await add_money(ctx.user.id, -MONEY_CHECK_FEE)
             feed = f'__{MONEY_CHECK_FEE / 100:,.2f} Ł__를 사용하여 다른 사람의 소지금을 확인했습니다. '
 
         # money in hand
-        having = get_money(member.id)
+        having = await get_money(member.id)
 
         # ppl
         ppl_message = ''
-        ppl_having, _ = get_inventory(member.id).get(get_const('db.ppl_having'), (0, 0))
+        ppl_having, _ = (await get_inventory(member.id)).get(get_const('db.ppl_having'), (0, 0))
         ppl_money = 0
         if ppl_having > 0:
-            ppl_price = int(get_value(get_const('db.ppl'))) * 100
+            ppl_price = int(await get_value(get_const('db.ppl'))) * 100
             ppl_money = ppl_having * ppl_price
             ppl_message = f'PPL은 __**{ppl_having}개**__를 가지고 있고, PPL 가격은 총 __{ppl_money / 100:,.2f} Ł__입니다. '
 
         # unpaid taxes
-        tax = get_tax(ctx.user.id)
+        tax = await get_tax(ctx.user.id)
         tax_message = ''
         if tax:
             tax_message = f'미납 세금은 __**{tax / 100:,.2f} Ł**__입니다. '
@@ -341,7 +395,7 @@ class MoneyCog(Cog):
             return
 
         # check if user has enough money
-        having = get_money(ctx.user.id)
+        having = await get_money(ctx.user.id)
         if having < amount:
             await ctx.response.send_message(
                 f':x: 소지금이 부족합니다. '
@@ -350,8 +404,8 @@ class MoneyCog(Cog):
             return
 
         # update database
-        add_money(ctx.user.id, -amount)
-        non_tax, tax = add_money_with_tax(to.id, amount)
+        await add_money(ctx.user.id, -amount)
+        non_tax, tax = await add_money_with_tax(to.id, amount)
         tax_message = generate_tax_message(tax)
 
         await ctx.response.send_message(
@@ -359,7 +413,7 @@ class MoneyCog(Cog):
 
     @command(description='돈 소지 현황을 확인합니다.')
     async def rank(self, ctx: Interaction, ephemeral: bool = True):
-        ranking = get_money_ranking()
+        ranking = await get_money_ranking()
 
         strings = list()
         for user_id, money_, _ in ranking:
@@ -383,14 +437,14 @@ class MoneyCog(Cog):
     @command(description='로스화 발행량을 확인합니다.')
     async def issue(self, ctx: Interaction, ephemeral: bool = True):
         await ctx.response.defer(ephemeral=ephemeral)
-        issue = get_issue()
-        add_issue_history(datetime.now(), issue)
+        issue = await get_issue()
+        await add_issue_history(datetime.now(), issue)
         await ctx.edit_original_response(content=f'로스화의 현재 총 발행량은 __**{issue/100:,.2f} Ł**__입니다. '
                                                  f'({datetime.now()})')
 
     @item_group.command(description='소지품을 확인합니다.')
     async def inventory(self, ctx: Interaction):
-        having = get_inventory(ctx.user.id)
+        having = await get_inventory(ctx.user.id)
 
         # if inventory is empty
         if len(having) <= 0:
@@ -410,7 +464,7 @@ class MoneyCog(Cog):
 
     @item_group.command(description='가지고 있는 물건을 판매합니다.')
     async def sell(self, ctx: Interaction, item: str, amount: int = 1):
-        inventory = get_inventory(ctx.user.id)
+        inventory = await get_inventory(ctx.user.id)
         having, price = inventory.get(item, (0, 0))
 
         if amount < 1:
@@ -424,44 +478,30 @@ class MoneyCog(Cog):
             return
 
         # check if sure when price == 0
-        message = None
+        prompted = False
         if not price:
-            await ctx.response.send_message(
-                ':warning: 이 상품은 가격이 책정되어있지 않습니다. 이 상품을 판매한다면 __**0.00 Ł**__를 받게 됩니다. '
-                '이 상품을 그래도 판매하시겠습니까?')
-            message = await ctx.original_response()
-            await wait((message.add_reaction(get_const('emoji.x')), message.add_reaction(get_const('emoji.o'))))
-
-            try:
-                res: tuple[Reaction, Member] = await self.bot.wait_for(
-                    'reaction_add',
-                    timeout=60.0,
-                    check=check_reaction(OX_EMOJIS, ctx, message.id))
-                await message.clear_reactions()
-            except AsyncioTimeoutError:
-                await message.edit(content=f':x: 시간이 초과되어 작업이 취소되었습니다.')
-                return
-
-            if res[0].emoji == get_const('emoji.x'):
-                await message.edit(content=f':x: 사용자가 작업을 취소하였습니다.')
+            prompted = True
+            if not await confirm(
+                    ctx, ':warning: 이 상품은 가격이 책정되어있지 않습니다. 이 상품을 판매한다면 __**0.00 Ł**__를 받게 됩니다. '
+                         '이 상품을 그래도 판매하시겠습니까?'):
                 return
 
         # process sell
         delta = price * amount
-        set_inventory(ctx.user.id, item, having - amount, price)
-        non_tax, tax = add_money_with_tax(ctx.user.id, delta)
+        await set_inventory(ctx.user.id, item, having - amount, price)
+        non_tax, tax = await add_money_with_tax(ctx.user.id, delta)
         tax_message = generate_tax_message(tax)
         content = f'__{item}__{eul_reul(item)} __{amount}개__ 판매하여 __**{delta / 100:,.2f} Ł**__를 얻었습니다. ' \
-                  f'{tax_message}현재 소지금은 __{get_money(ctx.user.id) / 100:,.2f} Ł__입니다.'
+                  f'{tax_message}현재 소지금은 __{await get_money(ctx.user.id) / 100:,.2f} Ł__입니다.'
 
-        if message is None:
-            await ctx.response.send_message(content)
+        if prompted:
+            await ctx.edit_original_response(content=content)
         else:
-            await message.edit(content=content)
+            await ctx.response.send_message(content)
 
     @sell.autocomplete("item")
     async def sell_autocomplete(self, ctx: Interaction, current: str) -> list[Choice[str]]:
-        inventory = get_inventory(ctx.user.id)
+        inventory = await get_inventory(ctx.user.id)
 
         result = list(map(lambda x: Choice(name=f'{x[0]} ({x[1][0]} 개, 각각 {x[1][1] / 100:,.2f} Ł)', value=x[0]),
                           filter(lambda x: current.lower() in x[0].lower(), inventory.items())))
@@ -471,7 +511,7 @@ class MoneyCog(Cog):
     @tax_group.command(description='미납 세금을 확인합니다.', name='check')
     async def tax_check(self, ctx: Interaction):
         # if there is no tax
-        tax_amount = get_tax(ctx.user.id)
+        tax_amount = await get_tax(ctx.user.id)
         if tax_amount <= 0:
             try:
                 name = ctx.user.nick
@@ -490,8 +530,8 @@ class MoneyCog(Cog):
         amount = round(amount * 100)
 
         # calculate `will_pay`
-        tax_amount = get_tax(ctx.user.id)
-        having: int = get_money(ctx.user.id)
+        tax_amount = await get_tax(ctx.user.id)
+        having: int = await get_money(ctx.user.id)
         if amount == 0.0:
             amount = tax_amount
         will_pay: int = min(tax_amount, amount)
@@ -510,8 +550,8 @@ class MoneyCog(Cog):
             return
 
         # process
-        add_money(ctx.user.id, -will_pay)
-        add_tax(ctx.user.id, -will_pay)
+        await add_money(ctx.user.id, -will_pay)
+        await add_tax(ctx.user.id, -will_pay)
         await ctx.response.send_message(
             f'__**{will_pay / 100:,.2f} Ł**__를 납세했습니다. '
             f'현재 미납 세금은 __{(tax_amount - will_pay) / 100:,.2f} Ł__입니다.')
@@ -521,19 +561,28 @@ class MoneyCog(Cog):
         amount *= 100
 
         if amount <= 0.0:
-            amount = get_asset(ctx.user.id)
+            amount = await get_asset(ctx.user.id)
 
         tax = calculate_tax(amount)
         await ctx.response.send_message(f'__{amount / 100:,.2f} Ł__에 대한 세율은 __{tax / amount * 100:.2f}%__로, '
                                         f'세금은 __**{tax / 100:,.2f} Ł/월**__입니다.',
                                         ephemeral=True)
 
-    @has_role(get_const('role.harnavin'))
+    @has_const_role('role.harnavin')
     @tax_group.command(description='세금을 징수합니다.', name='collect')
-    async def tax_collect(self, ctx: Interaction):
+    async def tax_collect(self, ctx: Interaction, force: bool = False):
         await ctx.response.send_message('세금을 징수중입니다...', ephemeral=True)
-        await self.collect_taxes()
-        await ctx.edit_original_response(content='세금을 징수했습니다.')
+
+        now = datetime.now(timezone.utc)
+        result = await self.collect_taxes(f'{now.year}-{now.month:02d}', force)
+        if result is None:
+            await ctx.edit_original_response(
+                content=':x: 이번 달 세금은 이미 징수되었습니다. 다시 징수하려면 `force` 값을 `True`로 설정해주세요.')
+            return
+
+        count, total, elapsed = result
+        await ctx.edit_original_response(
+            content=f'__{count}개__ 계정에서 총 __**{total / 100:,.2f} Ł**__의 세금을 징수했습니다. ({elapsed:.2f}초)')
 
     @tax_collect.error
     async def new_lecture_error(self, ctx: Interaction, error: Exception):
@@ -3,7 +3,7 @@ from discord.app_commands import Group
 from discord.ext.commands import Cog, Bot
 
 from util import get_const
-from util.db import get_money, set_money, add_tax
+from util.db import get_money, add_money, add_tax, flush_rewards
 
 
 class SettleSession:
@@ -142,16 +142,19 @@ class MoneySettleCog(Cog):
                                             embed=session.get_embed())
             return
 
+        # pay pending rewards first so the balances below are the stored ones
+        await flush_rewards()
+
         logs = list()
         moxes = session.get_moxes()
         for user_id, mox in moxes.items():
             mox = round(mox * 100)
-            having = get_money(user_id)
+            having = await get_money(user_id)
             if having + mox >= 0:
-                set_money(user_id, having + mox)
+                await add_money(user_id, mox)
             else:
-                set_money(user_id, 0)
-                add_tax(user_id, -mox - having)
+                await add_money(user_id, -having)
+                await add_tax(user_id, -mox - having)
 
             user = self.bot.get_user(user_id)
             if mox >= 0:
@@ -1,27 +1,23 @@
-from asyncio import sleep
+from asyncio import Event, Task, create_task, wait_for, TimeoutError as AsyncioTimeoutError
 from datetime import date, datetime, timedelta
+from heapq import heappush, heappop
 from pprint import pformat
 from typing import Optional
 
 from discord import Interaction, app_commands, Message, Member, VoiceState, RawReactionActionEvent
 from discord.app_commands import command, Choice
-from discord.app_commands.checks import has_role
-from discord.ext.commands import Cog
+from discord.ext.commands import Cog, Bot
 
-from util import get_const, get_exchange_rates, eun_neun, exchangeable_currencies
+from util import get_exchange_rates, eun_neun, exchangeable_currencies, has_const_role
+from util.db import get_connection
 
 
 class Reminder:
-    def __init__(self, time: datetime, message: str, user_id: int):
+    def __init__(self, time: datetime, message: str, user_id: int, id_: int = -1):
         self.time = time
         self.message = message
         self.user_id = user_id
-
-    async def wait(self):
-        delta = self.time - datetime.now()
-        seconds = delta.days * 24 * 60 + delta.seconds + delta.microseconds / 1000000
-
-        await sleep(seconds)
+        self.id = id_
 
 
 def check_reminder(delta: timedelta) -> str:
@@ -33,17 +29,108 @@ def check_reminder(delta: timedelta) -> str:
     return ''
 
 
-async def invoke_reminder(reminder: Reminder, ctx: Interaction, reminders: list):
-    # set reminder
-    await ctx.response.send_message(f'__{reminder.time}__에 알리는 리마인더를 설정했습니다. '
-                                    f'리마인더 실행 중에 유르파틴이 재시작되는경우 **리마인더가 실행되지 않습니다.**')
-    reminders.append(reminder)
-    await reminder.wait()
+async def create_reminder_table():
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('CREATE TABLE IF NOT EXISTS reminder ('
+                             'id INT AUTO_INCREMENT PRIMARY KEY, user_id BIGINT, time DATETIME, message TEXT, '
+                             'INDEX (time))')
+        await database.commit()
+
+
+async def get_reminders() -> list[Reminder]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT id, user_id, time, message FROM reminder')
+        return [Reminder(time, message, user_id, id_) for id_, user_id, time, message in await cursor.fetchall()]
+
+
+async def add_reminder(reminder: Reminder):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO reminder(user_id, time, message) VALUES (%s, %s, %s)',
+                             (reminder.user_id, reminder.time, reminder.message))
+        reminder.id = cursor.lastrowid
+        await database.commit()
+
+
+async def remove_reminder(id_: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('DELETE FROM reminder WHERE id = %s', (id_,))
+        await database.commit()
+
+
+class ReminderScheduler:
+    """keeps pending reminders in a min-heap by time and sends them from a single task."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.heap: list[tuple[datetime, int]] = list()
+        self.reminders: dict[int, Reminder] = dict()
+        # user id -> reminder id -> reminder
+        self.user_reminders: dict[int, dict[int, Reminder]] = dict()
+        # set when a reminder is added, since it may be earlier than the one being waited for
+        self.added = Event()
+        self.task: Optional[Task] = None
+
+    def add(self, reminder: Reminder):
+        heappush(self.heap, (reminder.time, reminder.id))
+        self.reminders[reminder.id] = reminder
+        self.user_reminders.setdefault(reminder.user_id, dict())[reminder.id] = reminder
+        self.added.set()
+
+    def get_user_reminders(self, user_id: int) -> list[Reminder]:
+        return sorted(self.user_reminders.get(user_id, dict()).values(), key=lambda x: x.time)
+
+    def start(self):
+        self.task = create_task(self.run())
 
-    # notification
-    content = f'\n> {reminder.message}' if reminder.message else ''
-    await ctx.user.send(f'{ctx.user.mention} 리마인더가 알려드립니다. __{reminder.time}__입니다.{content}')
-    reminders.remove(reminder)
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            self.added.clear()
+
+            if not self.heap:
+                await self.added.wait()
+                continue
+
+            time, id_ = self.heap[0]
+            if (seconds := (time - datetime.now()).total_seconds()) > 0:
+                try:
+                    await wait_for(self.added.wait(), seconds)
+                except AsyncioTimeoutError:
+                    pass
+                continue
+
+            heappop(self.heap)
+            reminder = self.reminders.pop(id_)
+            self.user_reminders[reminder.user_id].pop(id_)
+            if not self.user_reminders[reminder.user_id]:
+                self.user_reminders.pop(reminder.user_id)
+
+            try:
+                await self.notify(reminder)
+            except Exception as e:
+                print(f'Failed to send reminder {reminder.id}: {e!r}')
+            finally:
+                # delivered or not, the reminder must not be reloaded forever
+                try:
+                    await remove_reminder(reminder.id)
+                except Exception as e:
+                    print(f'Failed to remove reminder {reminder.id}: {e!r}')
+
+    async def notify(self, reminder: Reminder):
+        user = self.bot.get_user(reminder.user_id) or await self.bot.fetch_user(reminder.user_id)
+        content = f'\n> {reminder.message}' if reminder.message else ''
+        await user.send(f'{user.mention} 리마인더가 알려드립니다. __{reminder.time}__입니다.{content}')
+
+
+async def invoke_reminder(reminder: Reminder, ctx: Interaction, scheduler: ReminderScheduler):
+    await add_reminder(reminder)
+    scheduler.add(reminder)
+    await ctx.response.send_message(f'__{reminder.time}__에 알리는 리마인더를 설정했습니다.')
 
 
 async def conditionally_unafk(member, nicks):
@@ -54,10 +141,20 @@ async def conditionally_unafk(member, nicks):
 class UtilCog(Cog):
     reminder_group = app_commands.Group(name='reminder', description='리마인더 관련 명령어입니다.')
 
-    def __init__(self):
-        self.reminders = list()
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.reminders = ReminderScheduler(bot)
         self.afk_nicknames = dict()
 
+    async def cog_load(self):
+        await create_reminder_table()
+        for reminder in await get_reminders():
+            self.reminders.add(reminder)
+        self.reminders.start()
+
+    async def cog_unload(self):
+        self.reminders.stop()
+
     @Cog.listener()
     async def on_message(self, message: Message):
         await conditionally_unafk(message.author, self.afk_nicknames)
@@ -71,7 +168,7 @@ class UtilCog(Cog):
         await conditionally_unafk(payload.member, self.afk_nicknames)
 
     @command(name='eval', description='유르파틴 수식 내용을 확인합니다.')
-    @has_role(get_const('role.harnavin'))
+    @has_const_role('role.harnavin')
     async def eval_(self, ctx: Interaction, variable: str):
         try:
             formatted = pformat(eval(variable), indent=2)
@@ -129,7 +226,7 @@ class UtilCog(Cog):
 
     @reminder_group.command(description='예약되어있는 리마인더를 확인합니다.')
     async def check(self, ctx: Interaction):
-        reminders = sorted(filter(lambda x: x.user_id == ctx.user.id, self.reminders), key=lambda x: x.time)
+        reminders = self.reminders.get_user_reminders(ctx.user.id)
 
         if not reminders:
             await ctx.response.send_message('생성되어있는 리마인더가 없습니다.', ephemeral=True)
@@ -144,7 +241,7 @@ class UtilCog(Cog):
 
     @command(name='exchange', description='한국 원(KRW)을 다른 단위의 돈으로 환전합니다.')
     async def exchange(self, ctx: Interaction, currency: str, amount: float = 0.0):
-        exchange_rates = get_exchange_rates()
+        exchange_rates = await get_exchange_rates()
 
         if currency not in exchange_rates:
             await ctx.response.send_message(f'화폐 `{currency}`에 대한 환전 정보를 확인할 수 없습니다.')
@@ -217,4 +314,4 @@ class UtilCog(Cog):
 
 
 async def setup(bot):
-    await bot.add_cog(UtilCog())
+    await bot.add_cog(UtilCog(bot))
@@ -0,0 +1,95 @@
+from random import Random
+
+import pytest
+
+from cogs.go_cog import GoBoard, GoEngine, IllegalMoveError, NEIGHBORS, SIDE, BLACK, WHITE, NONE
+
+
+def flood_group(cells: list[str], index: int) -> tuple[set[int], set[int]]:
+    """stones of the group at `index` and its liberties, by flood fill."""
+
+    stones, liberties = {index}, set()
+    stack = [index]
+    while stack:
+        for neighbor in NEIGHBORS[stack.pop()]:
+            if cells[neighbor] == NONE:
+                liberties.add(neighbor)
+            elif cells[neighbor] == cells[index] and neighbor not in stones:
+                stones.add(neighbor)
+                stack.append(neighbor)
+    return stones, liberties
+
+
+def reference_play(cells: list[str], index: int, stone: str) -> int:
+    """plays on `cells` without the superko check, raising `IllegalMoveError` like the engine."""
+
+    if cells[index] != NONE:
+        raise IllegalMoveError()
+
+    cells[index] = stone
+    captured = set()
+    for neighbor in NEIGHBORS[index]:
+        if cells[neighbor] not in (NONE, stone):
+            group, liberties = flood_group(cells, neighbor)
+            if not liberties:
+                captured |= group
+    if not captured and not flood_group(cells, index)[1]:
+        cells[index] = NONE
+        raise IllegalMoveError()
+
+    for captured_stone in captured:
+        cells[captured_stone] = NONE
+    return len(captured)
+
+
+def assert_consistent(engine: GoEngine, cells: list[str]):
+    assert engine.board.to_string() == ''.join(cells)
+    seen = set()
+    for i, stone in enumerate(cells):
+        if stone == NONE or i in seen:
+            continue
+        group, liberties = flood_group(cells, i)
+        seen |= group
+        assert sorted(engine.get_group(i)) == sorted(group)
+        assert all(engine.find(j) == engine.find(i) for j in group)
+        # pseudo-liberties count (stone, empty neighbor) pairs, so only their emptiness must agree
+        assert (engine.liberties[engine.find(i)] == 0) == (not liberties)
+
+
+def test_rebuild_counts_edge_pair_liberties():
+    engine = GoEngine(GoBoard.from_string('bb'))
+    root = engine.find(0)
+    assert engine.liberties[root] == 3
+    assert sorted(engine.get_group(0)) == [0, 1]
+
+
+def test_rebuild_counts_later_neighbors():
+    engine = GoEngine(GoBoard.from_string('wb'))
+    assert engine.liberties[engine.find(0)] == 1
+    assert engine.liberties[engine.find(1)] == 2
+
+    # the white stone is still alive, so black can capture it by filling its last liberty
+    assert engine.play(SIDE, BLACK) == 1
+    assert engine.board[0] == NONE
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_rebuilt_engine_matches_flood_fill(seed: int):
+    random = Random(seed)
+    cells = [NONE] * (SIDE * SIDE)
+    engine = GoEngine(GoBoard())
+
+    for move in range(2000):
+        if move % 50 == 0:
+            engine = GoEngine(GoBoard.from_string(''.join(cells)))
+
+        index, stone = random.randrange(SIDE * SIDE), random.choice((BLACK, WHITE))
+        try:
+            expected = reference_play(cells, index, stone)
+        except IllegalMoveError:
+            with pytest.raises(IllegalMoveError):
+                engine.play(index, stone, superko=False)
+        else:
+            assert engine.play(index, stone, superko=False) == expected
+
+        assert_consistent(engine, cells)
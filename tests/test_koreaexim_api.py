@@ -0,0 +1,126 @@
+import json
+from asyncio import run, sleep
+from time import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from util import koreaexim_api
+
+RATES = [{'cur_unit': 'USD', 'deal_bas_r': '1,300.5'}, {'cur_unit': 'JPY(100)', 'deal_bas_r': '900'}]
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """the module with an empty memory cache, a disk cache under `tmp_path` and no real key."""
+
+    monkeypatch.setattr(koreaexim_api, '_exchange_rates', None)
+    monkeypatch.setattr(koreaexim_api, '_fetched_at', 0.0)
+    monkeypatch.setattr(koreaexim_api, '_fetching', None)
+    monkeypatch.setattr(koreaexim_api, 'CACHE_PATH', str(tmp_path / 'exchange_rates.json'))
+    monkeypatch.setattr(koreaexim_api, 'get_secret', lambda key: 'key')
+    return koreaexim_api
+
+
+def write_cache(api, rates: dict[str, float], fetched_at: float):
+    with open(api.CACHE_PATH, 'w', encoding='utf-8') as file:
+        json.dump({'rates': rates, 'fetched_at': fetched_at}, file)
+
+
+async def serve(api, monkeypatch, delay: float = 0.0) -> tuple[TestServer, list]:
+    """starts a fake api answering `RATES` after `delay` seconds, and returns it with the list of its requests."""
+
+    requests = list()
+
+    async def handler(request: web.Request) -> web.Response:
+        requests.append(request)
+        await sleep(delay)
+        return web.json_response(RATES)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    server = TestServer(app)
+    await server.start_server()
+    monkeypatch.setattr(api, 'URL', str(server.make_url('/')))
+    return server, requests
+
+
+def test_fresh_disk_cache_is_served_without_fetching(api, monkeypatch):
+    write_cache(api, {'USD': 1200.0}, time())
+
+    async def main():
+        server, requests = await serve(api, monkeypatch)
+        try:
+            assert await api.get_exchange_rates() == {'USD': 1200.0}
+            assert api._fetching is None
+            assert not requests
+        finally:
+            await server.close()
+
+    run(main())
+
+
+def test_stale_rates_are_served_while_one_shared_fetch_revalidates(api, monkeypatch):
+    write_cache(api, {'USD': 1200.0}, time() - api.FRESH_FOR - 1)
+
+    async def main():
+        server, requests = await serve(api, monkeypatch)
+        try:
+            assert await api.get_exchange_rates() == {'USD': 1200.0}
+            assert await api.get_exchange_rates() == {'USD': 1200.0}
+            await api._fetching
+
+            assert len(requests) == 1
+            assert await api.get_exchange_rates() == {'USD': 1300.5, 'JPY(100)': 900.0}
+            with open(api.CACHE_PATH, encoding='utf-8') as file:
+                assert json.load(file)['rates'] == {'USD': 1300.5, 'JPY(100)': 900.0}
+        finally:
+            await server.close()
+
+    run(main())
+
+
+def test_cold_start_waits_for_the_fetch(api, monkeypatch):
+    async def main():
+        server, requests = await serve(api, monkeypatch)
+        try:
+            assert await api.get_exchange_rates() == {'USD': 1300.5, 'JPY(100)': 900.0}
+            assert len(requests) == 1
+        finally:
+            await server.close()
+
+    run(main())
+
+
+def test_timeout_falls_back_to_disk_cache(api, monkeypatch):
+    write_cache(api, {'USD': 1200.0}, time() - api.FRESH_FOR - 1)
+    monkeypatch.setattr(api, 'TIMEOUT', 0.1)
+
+    async def main():
+        server, _ = await serve(api, monkeypatch, delay=1)
+        try:
+            assert await api.get_exchange_rates() == {'USD': 1200.0}
+            await api._fetching
+
+            # the failed fetch keeps the last good table, on disk as well
+            assert await api.get_exchange_rates() == {'USD': 1200.0}
+            with open(api.CACHE_PATH, encoding='utf-8') as file:
+                assert json.load(file)['rates'] == {'USD': 1200.0}
+        finally:
+            await server.close()
+
+    run(main())
+
+
+def test_timeout_without_cache_returns_no_rates(api, monkeypatch):
+    monkeypatch.setattr(api, 'TIMEOUT', 0.1)
+
+    async def main():
+        server, _ = await serve(api, monkeypatch, delay=1)
+        try:
+            assert await api.get_exchange_rates() == dict()
+        finally:
+            await server.close()
+
+    run(main())
@@ -0,0 +1,44 @@
+from math import exp
+from random import Random
+
+from cogs.money_amusements_cog import LOTTERY_NUMBER_RANGE, calculate_lottery_similarity, get_nearest_distances
+
+
+def calculate_lottery_similarity_reference(lotto1: set[int], lotto2: set[int]) -> float:
+    """the implementation before the distance tables."""
+
+    difference = 0
+    for number1 in lotto1:
+        number2 = min(lotto2, key=lambda x: abs(x - number1))
+        difference += min(abs(number1 - number2),
+                          abs(number1 - number2 - LOTTERY_NUMBER_RANGE),
+                          abs(number1 - number2 + LOTTERY_NUMBER_RANGE))
+    for number1 in lotto2:
+        number2 = min(lotto1, key=lambda x: abs(x - number1))
+        difference += min(abs(number1 - number2),
+                          abs(number1 - number2 - LOTTERY_NUMBER_RANGE),
+                          abs(number1 - number2 + LOTTERY_NUMBER_RANGE))
+    return exp((-0.8 * difference + 92) / 20) / exp(92 / 20)
+
+
+def random_lottery(random: Random) -> set[int]:
+    return set(random.sample(range(1, LOTTERY_NUMBER_RANGE + 1), 6))
+
+
+def test_similarity_matches_reference():
+    random = Random(0)
+    for _ in range(200):
+        win = random_lottery(random)
+        win_distances = get_nearest_distances(win)
+        for _ in range(50):
+            lotto = random_lottery(random)
+            assert calculate_lottery_similarity(win, win_distances, lotto) \
+                == calculate_lottery_similarity_reference(win, lotto)
+
+
+def test_similarity_at_range_edges():
+    # nearest numbers are picked by plain distance even when another one is closer around the circle
+    win = {1, 2, 3, 4, 5, 50}
+    lotto = {10, 99, 98, 97, 96, 95}
+    assert calculate_lottery_similarity(win, get_nearest_distances(win), lotto) \
+        == calculate_lottery_similarity_reference(win, lotto)
@@ -2,4 +2,6 @@ from .const import *
 from .postposition import *
 from .datetimes import *
 from .tools import *
-from .koreaexim_api import *
\ No newline at end of file
+from .koreaexim_api import *
+from .prompt import *
+from .checks import *
\ No newline at end of file
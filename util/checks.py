@@ -0,0 +1,23 @@
+from discord import Interaction, User
+from discord.app_commands import check, MissingRole, NoPrivateMessage
+
+from util import get_const
+
+__all__ = ['has_const_role']
+
+
+def has_const_role(key: str):
+    """
+    like `has_role`, but looks the role id up by `key` on every use, so `/reload` applies to it.
+    """
+
+    def predicate(ctx: Interaction) -> bool:
+        if isinstance(ctx.user, User):
+            raise NoPrivateMessage()
+
+        role_id = get_const(key)
+        if ctx.user.get_role(role_id) is None:
+            raise MissingRole(role_id)
+        return True
+
+    return check(predicate)
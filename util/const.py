@@ -1,30 +1,74 @@
 import json
+from os.path import getmtime
 
+CONST_PATH = 'res/const.json'
+SECRET_PATH = 'res/secret.json'
 
 const_override = dict()
 
+# path -> (mtime, flattened dotted-key index)
+_json_cache: dict[str, tuple[float, dict]] = dict()
+
 
 def get_secret(key: str):
-    return parse_json('res/secret.json', key)
+    return parse_json(SECRET_PATH, key)
 
 
 def get_const(key: str):
     if key in const_override:
         return const_override[key]
 
-    return parse_json('res/const.json', key)
+    return parse_json(CONST_PATH, key)
 
 
 def override_const(key: str, value):
     const_override[key] = value
 
 
-def parse_json(path: str, key: str):
+def flatten_json(data: dict, prefix: str = '') -> dict:
+    """
+    returns index of every dotted key in `data`, including intermediate objects.
+    `{'a': {'b': 1}}` -> `{'a': {'b': 1}, 'a.b': 1}`
+    """
+
+    result = dict()
+    for key, value in data.items():
+        key = prefix + key
+        result[key] = value
+        if isinstance(value, dict):
+            result.update(flatten_json(value, key + '.'))
+    return result
+
+
+def load_json(path: str) -> dict:
+    mtime = getmtime(path)
     with open(path, 'r', encoding='utf-8') as file:
-        const = json.load(file)
+        index = flatten_json(json.load(file))
+
+    _json_cache[path] = (mtime, index)
+    return index
 
-    key = key.split('.')
-    while key:
-        const = const[key.pop(0)]
 
-    return const
+def reload_json(force: bool = False) -> list[str]:
+    """
+    reloads loaded json files whose modification time has changed.
+    values are looked up on every use, except the ones only read on startup:
+    bot tokens, database settings and `cogs.disabled` still need a restart.
+
+    :param force: reload even if the file has not been modified
+    :return: reloaded paths
+    """
+
+    reloaded = list()
+    for path, (mtime, _) in tuple(_json_cache.items()):
+        if force or getmtime(path) != mtime:
+            load_json(path)
+            reloaded.append(path)
+    return reloaded
+
+
+def parse_json(path: str, key: str):
+    if (cache := _json_cache.get(path)) is not None:
+        return cache[1][key]
+
+    return load_json(path)[key]
@@ -1,205 +1,421 @@
-from datetime import datetime, timedelta, date
-from typing import Optional, Any, Generator
+from asyncio import Lock
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, date
+from time import monotonic
+from typing import Optional, Any, AsyncIterator
+from weakref import WeakKeyDictionary
+
+from aiomysql import create_pool, Pool, Connection
+
+from util import get_secret, get_const
+
+POOL_SIZE = 5
+POOL_RECYCLE = 3600  # seconds
+PING_AFTER_IDLE = 60  # seconds
+REWARD_FLUSH_THRESHOLD = 1_000  # cŁ, upper bound of unsettled rewards lost on a crash
+
+_pool: Optional[Pool] = None
+_pool_lock = Lock()
+_last_used: WeakKeyDictionary[Connection, float] = WeakKeyDictionary()
+
+# write-behind deltas of integer `values` rows, written by `flush_values`
+_pending_values: dict[str, int] = dict()
+# held while deltas are being written, so resets and reads see them exactly once
+_values_lock = Lock()
+# rewards not yet paid, settled with tax by `flush_rewards`
+_pending_rewards: dict[int, int] = dict()
+# held while rewards are being paid, so reads merging them see them exactly once
+_rewards_lock = Lock()
+
+
+async def get_pool() -> Pool:
+    global _pool
+
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await create_pool(
+                host=get_secret('database.host'),
+                user=get_secret('database.user'),
+                password=get_secret('database.password'),
+                db=get_secret('database.database'),
+                minsize=1,
+                maxsize=POOL_SIZE,
+                pool_recycle=POOL_RECYCLE,
+            )
+
+    return _pool
+
+
+@asynccontextmanager
+async def get_connection() -> AsyncIterator[Connection]:
+    """
+    checks out a connection from the pool for a single call.
+    connections idle for a while are pinged and reconnected if the server dropped them.
+    a transaction left open by the caller (e.g. plain reads) is rolled back,
+    as the pool closes connections released in a transaction.
+    """
 
-from pymysql import connect, Connection
+    pool = await get_pool()
+    async with pool.acquire() as database:
+        if monotonic() - _last_used.get(database, 0) > PING_AFTER_IDLE:
+            await database.ping(reconnect=True)
+        try:
+            yield database
+        finally:
+            if not database.closed and database.get_transaction_status():
+                await database.rollback()
+            _last_used[database] = monotonic()
 
-from util import get_secret
 
-_get_connection_cache: Optional[Connection] = None
-_get_connection_last_used = None
+async def get_money(user_id: int) -> int:
+    """
+    returns money including pending rewards, as they will be paid after tax.
+    """
 
+    async with _rewards_lock if user_id in _pending_rewards else nullcontext():
+        async with get_connection() as database, database.cursor() as cursor:
+            await cursor.execute('SELECT money, tax FROM money WHERE id = %s', (user_id,))
+            data = await cursor.fetchone()
 
-def get_connection():
-    global _get_connection_cache, _get_connection_last_used
-    now = datetime.now()
+        pending = _pending_rewards.get(user_id, 0)
 
-    # if old connection
-    if _get_connection_last_used is not None \
-            and now - _get_connection_last_used > timedelta(hours=1) \
-            and _get_connection_cache is not None:
-        _get_connection_cache.close()
-        _get_connection_cache = None
+    if data:
+        money, tax = data
+        return money + split_tax(pending, tax)[0]
 
-    # if connection does not exist
-    if _get_connection_cache is None:
-        _get_connection_cache = connect(
-            host=get_secret('database.host'),
-            user=get_secret('database.user'),
-            password=get_secret('database.password'),
-            database=get_secret('database.database'),
-        )
-        _get_connection_last_used = now
+    await create_account(user_id)
+    return pending
 
-    return _get_connection_cache
 
+async def create_account(user_id: int) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO money (id) VALUES (%s)', (user_id,))
+        await database.commit()
 
-def get_money(user_id: int) -> int:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT money FROM money WHERE id = %s', (user_id,))
-        data = cursor.fetchone()
 
-        if data:
-            return data[0]
+async def set_money(user_id: int, money: int) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('UPDATE money SET money = %s WHERE id = %s', (money, user_id))
+        await database.commit()
 
-        create_account(user_id)
-        return 0
 
+async def add_money(user_id: int, money: int) -> None:
+    """
+    :param user_id: User ID
+    :param money: Amount of money to add in cŁ
+    """
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO money (id, money) VALUES (%s, %s) '
+                             'ON DUPLICATE KEY UPDATE money = money + %s',
+                             (user_id, money, money))
+        await database.commit()
 
-def create_account(user_id: int) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO money (id) VALUES (%s)', (user_id,))
-        database.commit()
 
+async def get_money_ranking(limit: int = 10) -> tuple[tuple[Any, ...], ...]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT id, money, rank() OVER (ORDER BY money DESC) FROM money LIMIT %s', (limit,))
+        return await cursor.fetchall()
 
-def set_money(user_id: int, money: int) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('UPDATE money SET money = %s WHERE id = %s', (money, user_id))
-        database.commit()
 
+async def set_value(key: str, value) -> None:
+    async with _values_lock:
+        _pending_values.pop(key, None)
+        async with get_connection() as database, database.cursor() as cursor:
+            await cursor.execute('INSERT INTO `values` (`key`, value) VALUES (%s, %s) '
+                                 'ON DUPLICATE KEY UPDATE value = %s', (key, value, value))
+            await database.commit()
 
-def add_money(user_id: int, money: int) -> None:
-    """
-    :param user_id: User ID
-    :param money: Amount of money to add in cŁ
-    """
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO money (id, money) VALUES (%s, %s) '
-                       'ON DUPLICATE KEY UPDATE money = money + %s',
-                       (user_id, money, money))
-        database.commit()
 
+async def _fetch_value(key: str) -> Optional[str]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT value FROM `values` WHERE `key` = %s', (key,))
+        data = await cursor.fetchone()
+    return data[0] if data else None
 
-def get_money_ranking(limit: int = 10) -> tuple[tuple[Any, ...], ...]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT id, money, rank() OVER (ORDER BY money DESC) FROM money LIMIT %s', (limit,))
-        return cursor.fetchall()
 
+async def get_value(key: str) -> Optional[str]:
+    if key not in _pending_values:
+        return await _fetch_value(key)
 
-def set_value(key: str, value) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO `values` (`key`, value) VALUES (%s, %s) '
-                       'ON DUPLICATE KEY UPDATE value = %s', (key, value, value))
-        database.commit()
+    # merge deltas not yet flushed, after any flush in progress has settled them
+    async with _values_lock:
+        value = await _fetch_value(key)
+        return str(int(value or 0) + _pending_values.get(key, 0))
 
 
-def get_value(key: str) -> Optional[str]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT value FROM `values` WHERE `key` = %s', (key,))
-        data = cursor.fetchone()
+def increase_value(key: str, amount: int = 1) -> None:
+    """
+    increases an integer value in memory.
+    the delta is written to the database by the next `flush_values` call.
+    """
+
+    _pending_values[key] = _pending_values.get(key, 0) + amount
+
+
+async def flush_values() -> None:
+    """ writes every pending delta of `increase_value` in a single statement """
+
+    async with _values_lock:
+        if not _pending_values:
+            return
 
-        if data:
-            return data[0]
+        pending = tuple(_pending_values.items())
+        async with get_connection() as database, database.cursor() as cursor:
+            await cursor.execute('INSERT INTO `values` (`key`, value) VALUES '
+                                 + ', '.join(['(%s, %s)'] * len(pending))
+                                 + ' ON DUPLICATE KEY UPDATE value = value + VALUES(value)',
+                                 tuple(item for row in pending for item in row))
+            await database.commit()
 
-        return None
+        # drop only what was written, deltas added meanwhile wait for the next flush
+        for key, amount in pending:
+            if (left := _pending_values[key] - amount) == 0:
+                _pending_values.pop(key)
+            else:
+                _pending_values[key] = left
 
 
-def remove_value(key: str) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('DELETE FROM `values` WHERE `key` = %s', (key,))
-        database.commit()
+async def remove_value(key: str) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('DELETE FROM `values` WHERE `key` = %s', (key,))
+        await database.commit()
 
 
-def get_inventory(user_id: int) -> dict[str, tuple[int, int]]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT name, amount, price FROM inventory WHERE id = %s', (user_id,))
+async def get_inventory(user_id: int) -> dict[str, tuple[int, int]]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT name, amount, price FROM inventory WHERE id = %s', (user_id,))
         # noinspection PyTypeChecker
-        return dict(map(lambda x: (x[0], (x[1], x[2])), cursor.fetchall()))
+        return dict(map(lambda x: (x[0], (x[1], x[2])), await cursor.fetchall()))
 
 
-def get_total_inventory_value(user_id) -> int:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT SUM(price * amount) FROM inventory WHERE id = %s', (user_id,))
-        data = cursor.fetchone()
+async def get_total_inventory_value(user_id) -> int:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT SUM(price * amount) FROM inventory WHERE id = %s', (user_id,))
+        data = await cursor.fetchone()
     return int(data[0] if data[0] is not None else 0)
 
 
-def set_inventory(user_id: int, name: str, amount: int, price: int = 0) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
+async def set_inventory(user_id: int, name: str, amount: int, price: int = 0) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
         if amount:
-            cursor.execute('INSERT INTO inventory (id, name, amount, price) VALUES (%s, %s, %s, %s) '
-                           'ON DUPLICATE KEY UPDATE amount = %s, price = %s',
-                           (user_id, name, amount, price, amount, price))
+            await cursor.execute('INSERT INTO inventory (id, name, amount, price) VALUES (%s, %s, %s, %s) '
+                                 'ON DUPLICATE KEY UPDATE amount = %s, price = %s',
+                                 (user_id, name, amount, price, amount, price))
         else:
-            cursor.execute('DELETE FROM inventory WHERE id = %s AND name = %s', (user_id, name))
-        database.commit()
+            await cursor.execute('DELETE FROM inventory WHERE id = %s AND name = %s', (user_id, name))
+        await database.commit()
 
 
-def add_inventory(user_id: int, name: str, amount: int, price: int = 0) -> None:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO inventory (id, name, amount, price) VALUES (%s, %s, %s, %s) '
-                       'ON DUPLICATE KEY UPDATE amount = amount + %s', (user_id, name, amount, price, amount))
-        database.commit()
+async def add_inventory(user_id: int, name: str, amount: int, price: int = 0) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO inventory (id, name, amount, price) VALUES (%s, %s, %s, %s) '
+                             'ON DUPLICATE KEY UPDATE amount = amount + %s', (user_id, name, amount, price, amount))
+        await database.commit()
 
 
-# noinspection PyTypeChecker
-def get_lotteries() -> tuple[tuple[int, str, int], ...]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute("SELECT id, name, amount FROM inventory WHERE name LIKE '로또: %'")
-        return cursor.fetchall()
+def pack_lottery(numbers) -> bytes:
+    """ packs lottery numbers 1..100 into a 13-byte bitmask """
+    mask = 0
+    for number in numbers:
+        mask |= 1 << number
+    return mask.to_bytes(13, 'big')
+
+
+def unpack_lottery(packed: bytes) -> set[int]:
+    mask = int.from_bytes(packed, 'big')
+    return {number for number in range(mask.bit_length()) if mask >> number & 1}
+
+
+async def get_lottery_draw() -> int:
+    """ returns ID of the draw that newly bought lotteries take part in """
+    return int(await get_value('lottery.draw') or 0)
+
+
+async def migrate() -> None:
+    """
+    creates the tables `util.db` itself depends on, whichever cogs are enabled.
+    called once on startup before the cogs are loaded.
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('CREATE TABLE IF NOT EXISTS lottery ('
+                             'draw INT NOT NULL, '
+                             'user_id BIGINT NOT NULL, '
+                             'numbers BINARY(13) NOT NULL, '
+                             'amount INT NOT NULL DEFAULT 1, '
+                             'price INT NOT NULL DEFAULT 0, '
+                             'PRIMARY KEY (draw, user_id, numbers), '
+                             'INDEX lottery_user_id (user_id))')
+        # tables created before the index was added
+        await cursor.execute("SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                             "AND table_name = 'lottery' AND index_name = 'lottery_user_id'")
+        if await cursor.fetchone() is None:
+            await cursor.execute('CREATE INDEX lottery_user_id ON lottery (user_id)')
+        await database.commit()
+
+    if moved := await migrate_lotteries(await get_lottery_draw()):
+        print(f'Moved {moved} lottery rows from inventory to lottery table.')
+
+
+async def migrate_lotteries(draw: int) -> int:
+    """
+    moves lotteries stored as `로또: a, b, c, d, e, f` inventory rows into `lottery` table.
+
+    :return: number of moved rows
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute("SELECT id, name, amount, price FROM inventory WHERE name LIKE '로또: %' FOR UPDATE")
+        rows = await cursor.fetchall()
+        if rows:
+            await cursor.execute('INSERT INTO lottery (draw, user_id, numbers, amount, price) VALUES '
+                                 + ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+                                 + ' ON DUPLICATE KEY UPDATE amount = amount + VALUES(amount)',
+                                 tuple(item for user_id, name, amount, price in rows
+                                       for item in (draw, user_id, pack_lottery(map(int, name[4:].split(', '))),
+                                                    amount, price)))
+            await cursor.execute("DELETE FROM inventory WHERE name LIKE '로또: %'")
+        await database.commit()
+
+    return len(rows)
+
+
+async def get_lotteries(draw: int) -> list[tuple[int, set[int], int]]:
+    """
+    :return: user ID, numbers and amount of every lottery in the draw
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT user_id, numbers, amount FROM lottery WHERE draw = %s', (draw,))
+        return [(user_id, unpack_lottery(numbers), amount) for user_id, numbers, amount in await cursor.fetchall()]
+
+
+async def get_user_lotteries(draw: int, user_id: int) -> list[tuple[set[int], int]]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT numbers, amount FROM lottery WHERE draw = %s AND user_id = %s', (draw, user_id))
+        return [(unpack_lottery(numbers), amount) for numbers, amount in await cursor.fetchall()]
+
+
+async def get_lottery_count(draw: int, user_id: int) -> int:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT SUM(amount) FROM lottery WHERE draw = %s AND user_id = %s', (draw, user_id))
+        data = await cursor.fetchone()
+    return int(data[0] if data[0] is not None else 0)
+
+
+async def get_total_lottery_value(user_id: int) -> int:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT SUM(price * amount) FROM lottery WHERE user_id = %s', (user_id,))
+        data = await cursor.fetchone()
+    return int(data[0] if data[0] is not None else 0)
+
+
+async def add_lottery(draw: int, user_id: int, numbers: set[int], price: int) -> None:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO lottery (draw, user_id, numbers, price) VALUES (%s, %s, %s, %s) '
+                             'ON DUPLICATE KEY UPDATE amount = amount + 1',
+                             (draw, user_id, pack_lottery(numbers), price))
+        await database.commit()
 
 
-def clear_lotteries():
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute("DELETE FROM inventory WHERE name LIKE '로또: %'")
-        database.commit()
+async def settle_lotteries(draw: int, prices: dict[int, int]) -> dict[int, tuple[int, int]]:
+    """
+    pays every lottery prize with tax, clears the lotteries of the draw and opens the next draw
+    in a single transaction.
+
+    :return: non_tax amount and tax amount by user
+    """
+
+    async with get_connection() as database, database.cursor() as cursor:
+        payouts = await _pay_with_tax(cursor, prices) if prices else dict()
+        await cursor.execute('DELETE FROM lottery WHERE draw = %s', (draw,))
+        await cursor.execute('INSERT INTO `values` (`key`, value) VALUES (%s, %s) '
+                             'ON DUPLICATE KEY UPDATE value = %s', ('lottery.draw', draw + 1, draw + 1))
+        await database.commit()
+
+    return payouts
 
 
 # noinspection PyTypeChecker
-def get_streak_information(user_id: int) -> tuple[int, date, int]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT streak, last_attend, max_streak FROM attendance WHERE id = %s', (user_id,))
-        return cursor.fetchall()[0]
+async def get_streak_information(user_id: int) -> tuple[int, date, int]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT streak, last_attend, max_streak FROM attendance WHERE id = %s', (user_id,))
+        return (await cursor.fetchall())[0]
 
 
-def update_streak(user_id: int, streak: int, today: date, max_streak: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO attendance (id, streak, last_attend, max_streak) VALUES (%s, %s, %s, %s) '
-                       'ON DUPLICATE KEY UPDATE streak = %s, last_attend = %s, max_streak = %s',
-                       (user_id, streak, today, max_streak, streak, today, max_streak))
-        database.commit()
+async def update_streak(user_id: int, streak: int, today: date, max_streak: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO attendance (id, streak, last_attend, max_streak) VALUES (%s, %s, %s, %s) '
+                             'ON DUPLICATE KEY UPDATE streak = %s, last_attend = %s, max_streak = %s',
+                             (user_id, streak, today, max_streak, streak, today, max_streak))
+        await database.commit()
 
 
-def get_streak_rank() -> tuple[tuple[int, int]]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT id, max_streak FROM attendance ORDER BY streak DESC LIMIT 10')
-        return cursor.fetchall()
+async def get_streak_rank() -> tuple[tuple[int, int]]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT id, max_streak FROM attendance ORDER BY streak DESC LIMIT 10')
+        return await cursor.fetchall()
 
 
-def get_tax(user_id: int) -> int:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT tax FROM money WHERE id = %s', (user_id,))
-        data = cursor.fetchone()
-    return 0 if data is None else data[0]
+async def get_tax(user_id: int) -> int:
+    """
+    returns unpaid tax, excluding the part pending rewards will pay.
+    """
 
+    async with _rewards_lock if user_id in _pending_rewards else nullcontext():
+        async with get_connection() as database, database.cursor() as cursor:
+            await cursor.execute('SELECT tax FROM money WHERE id = %s', (user_id,))
+            data = await cursor.fetchone()
 
-def add_tax(user_id: int, amount: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO money (id, tax) VALUES (%s, %s) '
-                       'ON DUPLICATE KEY UPDATE tax = tax + %s',
-                       (user_id, amount, amount))
-        database.commit()
+        pending = _pending_rewards.get(user_id, 0)
+
+    if data is None:
+        return 0
+
+    tax = data[0]
+    return tax - split_tax(pending, tax)[1]
 
 
-def add_money_with_tax(user_id: int, amount: int) -> tuple[int, int]:
+async def add_tax(user_id: int, amount: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO money (id, tax) VALUES (%s, %s) '
+                             'ON DUPLICATE KEY UPDATE tax = tax + %s',
+                             (user_id, amount, amount))
+        await database.commit()
+
+
+def split_tax(amount: int, tax: int) -> tuple[int, int]:
+    """
+    up to 90% of `amount` is used to pay unpaid `tax` first.
+
+    :return: non_tax amount and tax amount
+    """
+
+    tax = min(round(amount * 0.9), tax)
+    return amount - tax, tax
+
+
+async def _pay_with_tax(cursor, amounts: dict[int, int]) -> dict[int, tuple[int, int]]:
+    """
+    gives money to every user in one statement, paying tax first.
+    must be called inside a transaction; the caller commits.
+    """
+
+    await cursor.execute('SELECT id, tax FROM money WHERE id IN %s FOR UPDATE', (tuple(amounts),))
+    taxes = dict(await cursor.fetchall())
+
+    result = dict()
+    for user_id, amount in amounts.items():
+        result[user_id] = split_tax(amount, taxes.get(user_id, 0))
+
+    await cursor.execute('INSERT INTO money (id, money, tax) VALUES '
+                         + ', '.join(['(%s, %s, %s)'] * len(result))
+                         + ' ON DUPLICATE KEY UPDATE money = money + VALUES(money), tax = tax + VALUES(tax)',
+                         tuple(item for user_id, (non_tax, tax) in result.items() for item in (user_id, non_tax, -tax)))
+    return result
+
+
+async def add_money_with_tax(user_id: int, amount: int) -> tuple[int, int]:
     """
     proceeds tax paying and give money.
 
@@ -208,36 +424,111 @@ def add_money_with_tax(user_id: int, amount: int) -> tuple[int, int]:
     :return: non_tax amount and tax amount
     """
 
-    tax = min(round(amount * 0.9), get_tax(user_id))
-    non_tax = amount - tax
+    async with get_connection() as database, database.cursor() as cursor:
+        result = await _pay_with_tax(cursor, {user_id: amount})
+        await database.commit()
+
+    return result[user_id]
+
+
+def add_reward(user_id: int, amount: int) -> bool:
+    """
+    accumulates a reward in memory. it is paid with tax by the next `flush_rewards` call.
+
+    :return: whether pending rewards reached `REWARD_FLUSH_THRESHOLD` and should be flushed now
+    """
+
+    _pending_rewards[user_id] = _pending_rewards.get(user_id, 0) + amount
+    return sum(_pending_rewards.values()) >= REWARD_FLUSH_THRESHOLD
+
+
+async def flush_rewards() -> None:
+    """ pays every pending reward of `add_reward` in a single transaction """
+
+    async with _rewards_lock:
+        if not _pending_rewards:
+            return
+
+        pending = dict(_pending_rewards)
+        async with get_connection() as database, database.cursor() as cursor:
+            await _pay_with_tax(cursor, pending)
+            await database.commit()
+
+        # drop only what was paid, rewards added meanwhile wait for the next flush
+        for user_id, amount in pending.items():
+            if (left := _pending_rewards[user_id] - amount) == 0:
+                _pending_rewards.pop(user_id)
+            else:
+                _pending_rewards[user_id] = left
+
+
+async def get_assets() -> dict[int, int]:
+    """
+    returns asset of every account in a single query.
+    asset is money + inventory and lottery value + PPL holdings - unpaid tax, including pending rewards.
+    """
+
+    async with _rewards_lock if _pending_rewards else nullcontext():
+        async with get_connection() as database, database.cursor() as cursor:
+            await cursor.execute('SELECT m.id, m.money + COALESCE(i.total, 0) + COALESCE(l.total, 0) '
+                                 '+ COALESCE(p.amount, 0) * COALESCE(CAST(v.value AS SIGNED), 0) * 100 - m.tax '
+                                 'FROM money m '
+                                 'LEFT JOIN (SELECT id, SUM(price * amount) AS total FROM inventory GROUP BY id) i '
+                                 'ON i.id = m.id '
+                                 'LEFT JOIN (SELECT user_id, SUM(price * amount) AS total FROM lottery GROUP BY user_id) l '
+                                 'ON l.user_id = m.id '
+                                 'LEFT JOIN inventory p ON p.id = m.id AND p.name = %s '
+                                 'LEFT JOIN `values` v ON v.`key` = %s',
+                                 (get_const('db.ppl_having'), get_const('db.ppl')))
+            data = await cursor.fetchall()
 
-    add_tax(user_id, -tax)
-    add_money(user_id, non_tax)
+        assets = dict()
+        for user_id, asset in data:
+            assets[user_id] = int(asset) + _pending_rewards.get(user_id, 0)
+
+    return assets
+
+
+async def add_taxes(taxes: dict[int, int], marker: str, force: bool = False) -> bool:
+    """
+    adds every tax in a single transaction and records `marker` as the last collection.
+    nothing is added if `marker` is already recorded, unless `force` is set.
+
+    :return: whether taxes were added
+    """
 
-    return non_tax, tax
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT value FROM `values` WHERE `key` = %s FOR UPDATE', ('tax.last_collection',))
+        data = await cursor.fetchone()
+        if not force and data is not None and data[0] == marker:
+            await database.rollback()
+            return False
 
+        if taxes:
+            await cursor.execute('INSERT INTO money (id, tax) VALUES '
+                                 + ', '.join(['(%s, %s)'] * len(taxes))
+                                 + ' ON DUPLICATE KEY UPDATE tax = tax + VALUES(tax)',
+                                 tuple(item for row in taxes.items() for item in row))
+        await cursor.execute('INSERT INTO `values` (`key`, value) VALUES (%s, %s) '
+                             'ON DUPLICATE KEY UPDATE value = %s', ('tax.last_collection', marker, marker))
+        await database.commit()
 
-def get_everyone_id() -> Generator[int, None, None]:
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('SELECT id FROM money')
-        while (row := cursor.fetchone()) is not None:
-            yield row[0]
+    return True
 
 
-def add_ppl_history(date_: date, value: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO ppl_history VALUES (%s, %s)', (value, date_))
-        database.commit()
+async def get_everyone_id() -> list[int]:
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('SELECT id FROM money')
+        return list(map(lambda x: x[0], await cursor.fetchall()))
 
 
-def add_issue_history(datetime_: datetime, value: int):
-    database = get_connection()
-    with database.cursor() as cursor:
-        cursor.execute('INSERT INTO issue_history VALUES (%s, %s)', (value, datetime_))
-        database.commit()
+async def add_ppl_history(date_: date, value: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO ppl_history VALUES (%s, %s)', (value, date_))
+        await database.commit()
 
 
-if __name__ == '__main__':
-    set_value('test', timedelta(seconds=1239487))
+async def add_issue_history(datetime_: datetime, value: int):
+    async with get_connection() as database, database.cursor() as cursor:
+        await cursor.execute('INSERT INTO issue_history VALUES (%s, %s)', (value, datetime_))
+        await database.commit()
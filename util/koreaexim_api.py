@@ -1,20 +1,89 @@
-from requests import get
+import json
+from asyncio import Task, create_task, shield
+from os.path import exists
+from time import time
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout
 
 from util import get_secret
 
-KEY = get_secret('koreaexim_openapi_key')
+URL = 'https://www.koreaexim.go.kr/site/program/financial/exchangeJSON'
+CACHE_PATH = 'res/exchange_rates.json'
+
+TIMEOUT = 2.5  # seconds, to answer a cold `/exchange` within the interaction deadline
+# rates change once a business day, so a table is served as is for an hour and revalidated in the background after
+FRESH_FOR = 60 * 60  # seconds
+
+_exchange_rates: Optional[dict[str, float]] = None
+_fetched_at = 0.0
+_fetching: Optional[Task] = None
 
 
-def get_exchange_rates() -> dict[str, float]:
+async def fetch_exchange_rates() -> dict[str, float]:
+    """
+    fetches exchange rates from the api.
+    the api answers an empty list on holidays and before the rates are announced, which is an error here.
+    """
+
+    async with ClientSession(timeout=ClientTimeout(total=TIMEOUT)) as session:
+        async with session.get(URL, params={'authkey': get_secret('koreaexim_openapi_key'), 'data': 'AP01'}) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+    if not data:
+        raise ValueError('no exchange rates announced')
+    return dict(map(lambda x: (x['cur_unit'], float(x['deal_bas_r'].replace(',', ''))), data))
+
+
+def load_exchange_rates():
+    global _exchange_rates, _fetched_at
+
+    if not exists(CACHE_PATH):
+        return
+    with open(CACHE_PATH, 'r', encoding='utf-8') as file:
+        cache = json.load(file)
+    _exchange_rates, _fetched_at = cache['rates'], cache['fetched_at']
+
+
+async def update_exchange_rates():
+    global _exchange_rates, _fetched_at
+
+    try:
+        exchange_rates = await fetch_exchange_rates()
+    except Exception as e:
+        # keep serving the last good table
+        print(f'Failed to fetch exchange rates: {e!r}')
+        return
+
+    _exchange_rates, _fetched_at = exchange_rates, time()
+    with open(CACHE_PATH, 'w', encoding='utf-8') as file:
+        json.dump({'rates': _exchange_rates, 'fetched_at': _fetched_at}, file)
+
+
+async def get_exchange_rates() -> dict[str, float]:
     """
     returns exchange rate from krw to the currency
     if 1 USD is exchangable with 1200 KRW, USD -> 1200.0
+
+    stale rates are returned immediately while newer ones are fetched in the background,
+    and concurrent calls share one fetch.
     """
 
-    link = f'https://www.koreaexim.go.kr/site/program/financial/exchangeJSON?authkey={KEY}&data=AP01'
-    request = get(link)
-    json = request.json()
-    return dict(map(lambda x: (x['cur_unit'], float(x['deal_bas_r'].replace(',', ''))), json))
+    global _fetching
+
+    if _exchange_rates is None:
+        load_exchange_rates()
+
+    if _exchange_rates is not None and time() - _fetched_at < FRESH_FOR:
+        return _exchange_rates
+
+    if _fetching is None or _fetching.done():
+        _fetching = create_task(update_exchange_rates())
+
+    if _exchange_rates is None:
+        await shield(_fetching)
+    return _exchange_rates or dict()
 
 
 exchangeable_currencies = [
@@ -0,0 +1,134 @@
+from typing import Optional
+
+from discord import Interaction, ButtonStyle, Embed, PartialMessage
+from discord.ui import View, Button
+
+from util import get_const
+
+__all__ = ['PROMPT_LIMIT_MESSAGE', 'reserve_prompt', 'release_prompt', 'prompt', 'get_prompt_message', 'confirm']
+
+PROMPT_TIMEOUT = 60.0  # seconds
+MAX_PROMPTS_PER_USER = 3
+
+TIMEOUT_MESSAGE = ':x: 시간이 초과되어 작업이 취소되었습니다.'
+CANCEL_MESSAGE = ':x: 사용자가 작업을 취소하였습니다.'
+PROMPT_LIMIT_MESSAGE = ':x: 응답하지 않은 선택지가 너무 많습니다. 먼저 열려있는 선택지에 응답해주세요.'
+
+# user id -> count of prompts waiting for the user
+_open_prompts: dict[int, int] = dict()
+
+
+class Prompt(View):
+    """buttons only the user can press. `choice` is the index of the pressed button, if any."""
+
+    def __init__(self, user_id: int, buttons: list[Button], timeout: float):
+        super().__init__(timeout=timeout)
+        self.user_id = user_id
+        self.choice: Optional[int] = None
+
+        for i, button in enumerate(buttons):
+            button.callback = self.get_callback(i)
+            self.add_item(button)
+
+    def get_callback(self, index: int):
+        async def callback(interaction: Interaction):
+            self.choice = index
+            self.stop()
+            await interaction.response.edit_message(view=None)
+
+        return callback
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        if interaction.user.id == self.user_id:
+            return True
+
+        await interaction.response.send_message(':x: 다른 사람에게 온 선택지입니다.', ephemeral=True)
+        return False
+
+
+def reserve_prompt(user_id: int) -> bool:
+    """
+    takes a prompt slot of the user, to be released with `release_prompt`.
+    reserve before charging for something that will prompt, so the fee is not lost to the limit.
+
+    :return: whether a slot was free
+    """
+
+    if (count := _open_prompts.get(user_id, 0)) >= MAX_PROMPTS_PER_USER:
+        return False
+
+    _open_prompts[user_id] = count + 1
+    return True
+
+
+def release_prompt(user_id: int) -> None:
+    if count := _open_prompts.pop(user_id) - 1:
+        _open_prompts[user_id] = count
+
+
+async def prompt(ctx: Interaction, content: str, buttons: list[Button], embed: Optional[Embed] = None,
+                 timeout: float = PROMPT_TIMEOUT, timeout_message: str = TIMEOUT_MESSAGE,
+                 reserved: bool = False, message: Optional[PartialMessage] = None) -> Optional[int]:
+    """
+    shows buttons with the response, or with the edited response if already responded, and waits for a press.
+    the response is edited to `timeout_message` on timeout.
+
+    :param reserved: whether the caller holds a slot of `reserve_prompt`, released by the caller
+    :param message: message to edit instead of the response, see `get_prompt_message`
+    :return: index of the pressed button, or None if timed out or the user has too many prompts open
+    """
+
+    if not reserved and not reserve_prompt(ctx.user.id):
+        if ctx.response.is_done():
+            await ctx.followup.send(PROMPT_LIMIT_MESSAGE, ephemeral=True)
+        else:
+            await ctx.response.send_message(PROMPT_LIMIT_MESSAGE, ephemeral=True)
+        return None
+
+    view = Prompt(ctx.user.id, buttons, timeout)
+    kwargs = {'content': content, 'view': view}
+    if embed is not None:
+        kwargs['embed'] = embed
+
+    try:
+        if message is not None:
+            await message.edit(**kwargs)
+        elif ctx.response.is_done():
+            await ctx.edit_original_response(**kwargs)
+        else:
+            await ctx.response.send_message(**kwargs)
+        await view.wait()
+    finally:
+        if not reserved:
+            release_prompt(ctx.user.id)
+
+    if view.choice is None:
+        if message is not None:
+            await message.edit(content=timeout_message, embed=None, view=None)
+        else:
+            await ctx.edit_original_response(content=timeout_message, embed=None, view=None)
+    return view.choice
+
+
+async def get_prompt_message(ctx: Interaction) -> PartialMessage:
+    """
+    returns the response as a channel message, which can be edited after the interaction token
+    expires in 15 minutes. prompts lasting longer should pass it to `prompt` as `message`.
+    """
+
+    return ctx.channel.get_partial_message((await ctx.original_response()).id)
+
+
+async def confirm(ctx: Interaction, content: str, **kwargs) -> bool:
+    """
+    asks the user to confirm with o and x buttons.
+    the response is edited to say so when the user cancels or does not answer.
+    """
+
+    choice = await prompt(ctx, content, [
+        Button(emoji=get_const('emoji.x'), style=ButtonStyle.secondary),
+        Button(emoji=get_const('emoji.o'), style=ButtonStyle.primary)], **kwargs)
+
+    if choice == 0:
+        await ctx.edit_original_response(content=CANCEL_MESSAGE)
+    return choice == 1